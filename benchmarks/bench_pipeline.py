@@ -0,0 +1,145 @@
+"""
+Benchmark of the rectification pipeline stages on synthetic islands
+
+    python -m benchmarks.bench_pipeline --output results.json --baseline baseline.json
+
+Each stage is timed separately, reporting median and 95th percentile times and the peak of memory allocated
+Compared to a baseline, any stage slower than `--tolerance` times its baseline median fails the run
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import ISLANDS
+from src.nh_data.terrain import NH_Terrain_Map
+from src.nh_data.converter import convert_nhmap_to_basicmap, convert_basicmap_to_rectified_nhmap
+
+
+STAGES = ['load_all', 'convert_nhmap_to_basicmap', 'convert_basicmap_to_rectified_nhmap', 'dump_all']
+
+
+def _load(data):
+    nh_map = NH_Terrain_Map()
+    nh_map.load_all(data)
+    return nh_map
+
+
+def _stage_functions(data):
+    """
+    Function of each stage, with its input computed by the previous stages
+    """
+    nh_map = _load(data)
+    basic_map = convert_nhmap_to_basicmap(nh_map)
+    rectified_map = convert_basicmap_to_rectified_nhmap(basic_map)
+    return {
+        'load_all': lambda: _load(data),
+        'convert_nhmap_to_basicmap': lambda: convert_nhmap_to_basicmap(nh_map),
+        'convert_basicmap_to_rectified_nhmap': lambda: convert_basicmap_to_rectified_nhmap(basic_map),
+        'dump_all': lambda: rectified_map.dump_all(),
+    }
+
+
+def measure(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # separate run, tracing allocations slows everything down
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'median_ms': float(np.median(times)) * 1000,
+        'p95_ms': float(np.percentile(times, 95)) * 1000,
+        'peak_kib': peak / 1024,
+    }
+
+
+def run(islands, repeat, seed):
+    results = {}
+    for name in islands:
+        functions = _stage_functions(ISLANDS[name](seed))
+        functions['convert_basicmap_to_rectified_nhmap']()  # warm up the pattern table
+        results[name] = {stage: measure(functions[stage], repeat) for stage in STAGES}
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """
+    Lists the stages whose median got slower than tolerance * baseline median
+    Differences under min_delta_ms are ignored as noise
+    """
+    regressions = []
+    for island, stages in results.items():
+        for stage, result in stages.items():
+            reference = baseline.get(island, {}).get(stage)
+            if reference is None:
+                continue
+            limit = max(reference['median_ms'] * tolerance, reference['median_ms'] + min_delta_ms)
+            if result['median_ms'] > limit:
+                regressions.append((island, stage, reference['median_ms'], result['median_ms']))
+    return regressions
+
+
+def print_results(results):
+    print(f"{'island':<8} {'stage':<38} {'median ms':>10} {'p95 ms':>10} {'peak KiB':>10}")
+    for island, stages in results.items():
+        for stage, result in stages.items():
+            print(f"{island:<8} {stage:<38} {result['median_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+                  f"{result['peak_kib']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the rectification pipeline stages')
+    parser.add_argument('--islands', nargs='+', choices=list(ISLANDS), default=list(ISLANDS))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to save results to')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='save results as the new --baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='allowed slowdown ratio (default: 1.25)')
+    parser.add_argument('--min-delta', type=float, default=0.5, help='ignored slowdown in ms (default: 0.5)')
+    args = parser.parse_args()
+
+    results = run(args.islands, args.repeat, args.seed)
+    print_results(results)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f'\n{len(regressions)} REGRESSION(S) against {args.baseline}:', file=sys.stderr)
+            for island, stage, before, after in regressions:
+                print(f'  {island} {stage}: {before:.3f} ms -> {after:.3f} ms ({after / before:.2f}x)',
+                      file=sys.stderr)
+            sys.exit(1)
+        print(f'\nno regression against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
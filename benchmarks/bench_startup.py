@@ -0,0 +1,143 @@
+"""
+Benchmark of the command line startup, from a fresh interpreter to the first rectified file
+
+    python -m benchmarks.bench_startup --output startup.json --baseline startup_baseline.json
+
+Each measure runs a new process: 'import' only imports the pipeline, 'first_output' runs main.py on a
+synthetic island until it prints its first result
+The rectification of .nht files must not import optional dependencies (SciPy, Pillow), the run fails if it does
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_pipeline import compare
+from benchmarks.synthetic import ISLANDS
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTIONAL_MODULES = ['scipy', 'PIL']
+
+_IMPORT_SCRIPT = 'import src.pipeline.batch'
+_MODULES_SCRIPT = f'''
+import sys
+from src.pipeline.batch import rectify_file
+rectify_file(sys.argv[1], sys.argv[2])
+print(' '.join(m for m in {OPTIONAL_MODULES!r} if m in sys.modules))
+'''
+
+
+def time_import():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT], cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+def time_first_output(input_path):
+    """
+    Time until main.py prints the result of `input_path`
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'main.py', input_path, '--force', '--workers', '1'],
+                               cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    elapsed = time.perf_counter() - start
+    process.communicate()
+    if process.returncode or 'FAILED' in line:
+        raise RuntimeError(f'main.py failed: {line.strip()}')
+    return elapsed
+
+
+def loaded_optional_modules(input_path, output_path):
+    """
+    Optional modules imported by the rectification of a .nht file
+    """
+    output = subprocess.run([sys.executable, '-c', _MODULES_SCRIPT, input_path, output_path],
+                            cwd=ROOT, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return output.split()
+
+
+def summarize(times):
+    return {
+        'median_ms': float(np.median(times)) * 1000,
+        'p95_ms': float(np.percentile(times, 95)) * 1000,
+    }
+
+
+def run(repeat, seed):
+    with tempfile.TemporaryDirectory() as directory:
+        input_path = os.path.join(directory, 'terrainAcres.nht')
+        with open(input_path, 'wb') as f:
+            f.write(ISLANDS['cliffs'](seed))
+
+        time_first_output(input_path)  # compiles the pattern table cache if needed
+        results = {
+            'import': summarize([time_import() for _ in range(repeat)]),
+            'first_output': summarize([time_first_output(input_path) for _ in range(repeat)]),
+        }
+        loaded = loaded_optional_modules(input_path, os.path.join(directory, 'out.nht'))
+    return {'startup': results}, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the command line startup')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to save results to')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='save results as the new --baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='allowed slowdown ratio (default: 1.25)')
+    parser.add_argument('--min-delta', type=float, default=20., help='ignored slowdown in ms (default: 20)')
+    args = parser.parse_args()
+
+    results, loaded = run(args.repeat, args.seed)
+    print(f"{'stage':<14} {'median ms':>10} {'p95 ms':>10}")
+    for stage, result in results['startup'].items():
+        print(f"{stage:<14} {result['median_ms']:>10.1f} {result['p95_ms']:>10.1f}")
+    print(f"optional modules imported: {', '.join(loaded) or 'none'}")
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'optional_modules': loaded,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if loaded:
+        print(f"\n.nht rectification imported {', '.join(loaded)}", file=sys.stderr)
+        failed = True
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f'\n{len(regressions)} REGRESSION(S) against {args.baseline}:', file=sys.stderr)
+            for _, stage, before, after in regressions:
+                print(f'  {stage}: {before:.1f} ms -> {after:.1f} ms ({after / before:.2f}x)', file=sys.stderr)
+            failed = True
+        else:
+            print(f'\nno regression against {args.baseline}')
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Synthetic islands for benchmarks, as NHSE dump-all contents
+
+Islands only set ground/water types and elevations, like a map prepared in NHSE before rectification
+"""
+import numpy as np
+
+from src.enums.tile_types import TerrainType
+from src.nh_data.terrain import NH_Terrain_Map
+
+
+HEIGHT = NH_Terrain_Map.HEIGHT
+WIDTH = NH_Terrain_Map.WIDTH
+
+_GROUND_CODE = int.from_bytes(TerrainType.Base.value, byteorder='little')
+_WATER_CODE = int.from_bytes(TerrainType.River8A.value, byteorder='little')
+
+
+def encode_island(elevation, water):
+    """
+    NHSE dump-all content of an island given as (HEIGHT, WIDTH) elevation and water arrays
+    """
+    nh_map = NH_Terrain_Map()
+    nh_map.elevation[...] = elevation
+    nh_map.terrain_code[...] = np.where(water, _WATER_CODE, _GROUND_CODE)
+    return nh_map.dump_all()
+
+
+def _ocean_border(water, width=6):
+    water[:width] = water[-width:] = True
+    water[:, :width] = water[:, -width:] = True
+    return water
+
+
+def _terraces(rng, levels, cell):
+    """
+    Smooth random heights quantized on `levels` elevations
+    """
+    coarse = rng.random((HEIGHT // cell + 2, WIDTH // cell + 2))
+    heights = np.kron(coarse, np.ones((cell, cell)))[:HEIGHT, :WIDTH]
+    for _ in range(cell // 2):
+        heights = (heights + np.roll(heights, 1, 0) + np.roll(heights, -1, 0)
+                   + np.roll(heights, 1, 1) + np.roll(heights, -1, 1)) / 5
+    heights = (heights - heights.min()) / (np.ptp(heights) + 1e-9)
+    return np.minimum((heights * levels).astype(np.uint8), levels - 1)
+
+
+def flat_island(seed=0):
+    elevation = np.ones((HEIGHT, WIDTH), dtype=np.uint8)
+    water = _ocean_border(np.zeros((HEIGHT, WIDTH), dtype=bool))
+    elevation[water] = 0
+    return encode_island(elevation, water)
+
+
+def water_island(seed=0):
+    return encode_island(np.zeros((HEIGHT, WIDTH), dtype=np.uint8), np.ones((HEIGHT, WIDTH), dtype=bool))
+
+
+def random_island(seed=0):
+    rng = np.random.default_rng(seed)
+    return encode_island(rng.integers(0, 7, (HEIGHT, WIDTH)), np.zeros((HEIGHT, WIDTH), dtype=bool))
+
+
+def cliffs_island(seed=0):
+    """
+    Many stacked plateaus, most tiles being next to a cliff
+    """
+    rng = np.random.default_rng(seed)
+    elevation = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    for _ in range(300):
+        y, x = rng.integers(0, HEIGHT), rng.integers(0, WIDTH)
+        h, w = rng.integers(2, 10, 2)
+        elevation[y:y+h, x:x+w] = rng.integers(0, 7)
+    return encode_island(elevation, np.zeros((HEIGHT, WIDTH), dtype=bool))
+
+
+def rivers_island(seed=0):
+    """
+    Terraces crossed by winding rivers, making waterfalls at each elevation step
+    """
+    rng = np.random.default_rng(seed)
+    elevation = _terraces(rng, 4, 16)
+    water = _ocean_border(np.zeros((HEIGHT, WIDTH), dtype=bool))
+    for _ in range(12):
+        y, x = rng.integers(8, HEIGHT - 8), rng.integers(8, WIDTH - 8)
+        for _ in range(120):
+            water[y:y+2, x:x+2] = True
+            if rng.random() < .5:
+                y = int(np.clip(y + rng.choice([-1, 1]), 1, HEIGHT - 3))
+            else:
+                x = int(np.clip(x + rng.choice([-1, 1]), 1, WIDTH - 3))
+    return encode_island(elevation, water)
+
+
+ISLANDS = {
+    'flat': flat_island,
+    'water': water_island,
+    'random': random_island,
+    'cliffs': cliffs_island,
+    'rivers': rivers_island,
+}
@@ -1,21 +1,109 @@
+import argparse
+import multiprocessing
+import sys
 
-from src.nh_data.terrain import NH_Terrain_Map
-from src.nh_data.converter import convert_nhmap_to_basicmap, convert_basicmap_to_rectified_nhmap
+from src.pipeline.batch import collect_inputs, run_batch, format_result, format_summary, DEFAULT_QUEUE_DEPTH
+from src.pipeline.result_cache import ResultCache, DEFAULT_MAX_BYTES
+from src.pipeline.server import serve, DEFAULT_HOST, DEFAULT_PORT
+from src.utils.profiling import Profiler, profiling
 
-if __name__ == '__main__':
 
-    imported_map = NH_Terrain_Map()
+def parse_args():
+    parser = argparse.ArgumentParser(description='Rectify cliffs, riversides and waterfalls of NHSE terrain dumps')
+    parser.add_argument('inputs', nargs='*', default=['terrainAcres.nht'],
+                        help='.nht files or map images, directories (their .nht files) or glob patterns '
+                             '(default: terrainAcres.nht)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: cpu count)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='rectify files even if their output is up to date')
+    parser.add_argument('--roads', action='store_true',
+                        help='keep the painted roads and rectify their shapes (default: roads are removed)')
+    parser.add_argument('--shared-memory', action='store_true',
+                        help='hand files over to the worker processes in shared memory, the parent doing all file I/O')
+    parser.add_argument('--async-io', action='store_true',
+                        help='overlap reading and writing files with rectification, for slow storage')
+    parser.add_argument('--queue-depth', type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help='files buffered between the --async-io stages (default: %(default)s)')
+    parser.add_argument('--validate', action='store_true',
+                        help='check that output tiles fit their input neighbourhoods, failing files otherwise')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='threads matching each map, to rectify a single map faster on several cores')
+    parser.add_argument('--acre-memo', action='store_true',
+                        help='reuse acres already rectified by the same process, for batches of similar islands')
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the rectified outputs cache (default: no cache)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // 2**20,
+                        help='maximum size of the cache in MiB (default: %(default)s)')
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='save time, calls and allocations of each stage to PATH, running in a single process')
+    parser.add_argument('--profile-format', choices=['json', 'chrome'], default='json',
+                        help='stages statistics (json) or Chrome trace events (chrome)')
+    parser.add_argument('--serve', action='store_true',
+                        help='run a rectification server instead, see README (inputs are ignored)')
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='address the server listens on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port the server listens on (default: %(default)s)')
+    parser.add_argument('--unix-socket', metavar='PATH', default=None,
+                        help='make the server listen on a unix socket instead of a port')
+    args = parser.parse_args()
+    if args.async_io and args.shared_memory:
+        parser.error('--async-io and --shared-memory can not be combined')
+    if args.queue_depth < 1:
+        parser.error('--queue-depth must be positive')
+    if args.profile:
+        # profiles are recorded in a single process, by the plain batch loop
+        if args.workers not in (None, 1):
+            parser.error('--profile runs in a single process, it can not be combined with --workers')
+        if args.shared_memory or args.async_io:
+            parser.error('--profile can not be combined with --shared-memory or --async-io')
+    return args
+
 
-    with open('terrainAcres.nht', 'rb') as f:
-        data = f.read()
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # for PyInstaller build
+    args = parse_args()
 
-    imported_map.load_all(data)
+    if args.serve:
+        try:
+            serve(workers=args.workers, host=args.host, port=args.port, unix_socket=args.unix_socket)
+        except (OSError, NotImplementedError) as e:
+            sys.exit(f'can not serve: {e}')
+        sys.exit()
 
-    converted_map = convert_nhmap_to_basicmap(imported_map)
-    # converted_map.save_img()
+    try:
+        input_paths = collect_inputs(args.inputs)
+    except ValueError as e:
+        sys.exit(str(e))
+    if not input_paths:
+        sys.exit('no input file found')
 
-    rectified_nh_map = convert_basicmap_to_rectified_nhmap(converted_map)
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, args.cache_size * 2**20, namespace='roads' if args.roads else '')
 
-    with open('terrainAcres_rectified.nht', 'wb') as f:
-        f.write(rectified_nh_map.dump_all())
+    if args.profile:
+        # worker processes stages would not be recorded
+        profiler = Profiler(trace_allocations=True)
+        with profiling(profiler):
+            results = run_batch(input_paths, workers=1, force=args.force, cache=cache, roads=args.roads,
+                                validate=args.validate, memoize=args.acre_memo, threads=args.threads,
+                                on_result=lambda result: print(format_result(result)))
+        profiler.save(args.profile, args.profile_format)
+    else:
+        pipeline_stats = None
+        if args.async_io:
+            from src.pipeline.async_batch import PipelineStats
+            pipeline_stats = PipelineStats()
+        results = run_batch(input_paths, workers=args.workers, force=args.force, cache=cache, roads=args.roads,
+                            validate=args.validate, memoize=args.acre_memo, threads=args.threads,
+                            shared_memory=args.shared_memory,
+                            async_io=args.async_io, queue_depth=args.queue_depth, pipeline_stats=pipeline_stats,
+                            on_result=lambda result: print(format_result(result)))
+        if pipeline_stats is not None and pipeline_stats.stages:
+            print(pipeline_stats.format())
+    print(format_summary(results, cache))
 
+    if any(result.status == 'failed' for result in results):
+        sys.exit(1)
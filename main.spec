@@ -13,7 +13,7 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['scipy'],  # only used by the legacy correlate rectifier, not reachable from main.py
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -409,18 +409,23 @@ class TerrainType(Enum):
     Fall424 = b'\x92\x00'
 
     def is_ground(self):
-        return self in [
-            TerrainType.Base, TerrainType.Cliff0A, TerrainType.Cliff0A_2, TerrainType.Cliff0A_3, TerrainType.Cliff1A,
-            TerrainType.Cliff1A_2, TerrainType.Cliff1A_3, TerrainType.Cliff2A, TerrainType.Cliff2C, TerrainType.Cliff3B,
-            TerrainType.Cliff3C, TerrainType.Cliff3A, TerrainType.Cliff4A, TerrainType.Cliff4B, TerrainType.Cliff4C,
-            TerrainType.Cliff5A, TerrainType.Cliff5B, TerrainType.Cliff6A, TerrainType.Cliff6B, TerrainType.Cliff7A,
-            TerrainType.Cliff8, TerrainType.Cliff2B
-        ]
+        return self in _GROUND_TYPES
+
+
+_GROUND_TYPES = frozenset([
+    TerrainType.Base, TerrainType.Cliff0A, TerrainType.Cliff0A_2, TerrainType.Cliff0A_3, TerrainType.Cliff1A,
+    TerrainType.Cliff1A_2, TerrainType.Cliff1A_3, TerrainType.Cliff2A, TerrainType.Cliff2C, TerrainType.Cliff3B,
+    TerrainType.Cliff3C, TerrainType.Cliff3A, TerrainType.Cliff4A, TerrainType.Cliff4B, TerrainType.Cliff4C,
+    TerrainType.Cliff5A, TerrainType.Cliff5B, TerrainType.Cliff6A, TerrainType.Cliff6B, TerrainType.Cliff7A,
+    TerrainType.Cliff8, TerrainType.Cliff2B
+])
 
 
 class RoadType(Enum):
     """
-    TODO handle roads
+    Road types and their corresponding NHSE dump code
+
+    Named Road<material><shape>, shapes being the same as River ones
     """
     Base = b'\x00\x00'
     RoadSoil0A = b'\x47\x00'
@@ -585,6 +590,76 @@ class RoadType(Enum):
     RoadWood8A = b'\x11\x01'
 
 
+class UnknownCodeError(ValueError):
+    """
+    Codes not belonging to an enum, found when decoding arrays
+    `unknown` lists the (position, code) of all of them
+    """
+    def __init__(self, enum, unknown):
+        self.enum = enum
+        self.unknown = unknown
+        listed = ', '.join(f'0x{code:04x} at {position}' for position, code in unknown[:10])
+        more = f' and {len(unknown) - 10} more' if len(unknown) > 10 else ''
+        super().__init__(f'{len(unknown)} invalid {enum.__name__} codes: {listed}{more}')
+
+    def __reduce__(self):
+        # pickled to be sent back from worker processes
+        return type(self), (self.enum, self.unknown)
+
+
+class CodeTable(object):
+    """
+    Conversions between members of a bytes-valued enum and their uint16 little-endian code
+
+    Arrays of codes are decoded to indices in `members`, and encoded back, with a single gather
+    """
+    UNKNOWN = -1
+
+    def __init__(self, enum):
+        self.enum = enum
+        self.members = list(enum)
+        self.codes = np.array([int.from_bytes(m.value, byteorder='little') for m in self.members], dtype=np.uint16)
+        self.code_to_index = np.full(1 << 16, self.UNKNOWN, dtype=np.int16)
+        self.code_to_index[self.codes] = np.arange(len(self.members))
+        self._members_by_code = dict(zip(self.codes.tolist(), self.members))
+
+    def code(self, member):
+        return int.from_bytes(member.value, byteorder='little')
+
+    def member(self, code):
+        try:
+            return self._members_by_code[int(code)]
+        except KeyError:
+            raise ValueError(f"{int(code).to_bytes(2, byteorder='little')!r} is not a valid {self.enum.__name__}")
+
+    def decode(self, codes):
+        """
+        Indices of the members of an array of codes
+        Raise UnknownCodeError listing all the unknown codes with their position
+        """
+        indices = self.code_to_index[codes]
+        unknown = np.argwhere(indices == self.UNKNOWN)
+        if len(unknown):
+            raise UnknownCodeError(self.enum, [
+                (tuple(int(i) for i in position), int(codes[tuple(position)])) for position in unknown
+            ])
+        return indices
+
+    def encode(self, indices):
+        """
+        Codes of an array of members indices
+        """
+        return self.codes[indices]
+
+
+TERRAIN_CODES = CodeTable(TerrainType)
+ROAD_CODES = CodeTable(RoadType)
+
+# TerrainType.is_ground for whole arrays, indexed by the uint16 code of the types
+GROUND_LUT = np.zeros(1 << 16, dtype=bool)
+GROUND_LUT[[TERRAIN_CODES.code(t) for t in _GROUND_TYPES]] = True
+
+
 def create_patches_array(string):
     dv = {
         "G": 1,
@@ -910,6 +985,14 @@ dict_patches = {
                                               'G.G□G.'),
 }
 
+# Road shapes follow river ones, the road being the water of the river patches
+# Roads 0B, 1B and 1C have no river counterpart and are not generated
+dict_road_patches = {
+    terrain_type.name[len('River'):]: -kernel_type
+    for terrain_type, (kernel_type, _) in dict_patches.items()
+    if terrain_type.name.startswith('River')
+}
+
 # Stores corresponding tiles with alternative shapes
 dict_alternatives = {
     TerrainType.Cliff3B: TerrainType.Cliff3C,  # default triangle
@@ -1,5 +1,10 @@
+import os
+
+import numpy as np
 from enum import Enum
-from PIL import Image
+from functools import partial
+
+from src.utils.grid import TileGrid
 
 
 class BasicTileType(Enum):
@@ -7,60 +12,151 @@ class BasicTileType(Enum):
     WATER = 1
 
 
+class _BasicArrays(object):
+    """
+    Columnar storage of basic tiles
+    """
+    def __init__(self, shape):
+        self.elevation = np.zeros(shape, dtype=np.uint8)
+        self.type = np.full(shape, BasicTileType.GROUND.value, dtype=np.uint8)  # BasicTileType values
+        self.is_triangle = np.zeros(shape, dtype=bool)
+
+
 class BasicTile(object):
     """
     Simple representation of the terrain
     Handles Ground, Water and elevation
     """
     def __init__(self, elevation=0, type=BasicTileType.GROUND, is_triangle=False):
+        self._arrays = _BasicArrays((1, 1))
+        self._y = 0
+        self._x = 0
         self.elevation = elevation
         self.type = type
         self.is_triangle = is_triangle  # for future use
 
+    @classmethod
+    def view(cls, arrays, y, x):
+        """
+        Tile backed by position (y, x) of `arrays`
+        """
+        tile = cls.__new__(cls)
+        tile._arrays = arrays
+        tile._y = y
+        tile._x = x
+        return tile
+
+    @property
+    def elevation(self):
+        return int(self._arrays.elevation[self._y, self._x])
+
+    @elevation.setter
+    def elevation(self, value):
+        self._arrays.elevation[self._y, self._x] = value
 
-class BasicMap(object):
+    @property
+    def type(self):
+        return BasicTileType(int(self._arrays.type[self._y, self._x]))
+
+    @type.setter
+    def type(self, value):
+        self._arrays.type[self._y, self._x] = value.value
+
+    @property
+    def is_triangle(self):
+        return bool(self._arrays.is_triangle[self._y, self._x])
+
+    @is_triangle.setter
+    def is_triangle(self, value):
+        self._arrays.is_triangle[self._y, self._x] = value
+
+
+class BasicMap(_BasicArrays):
     WIDTH = 112
     HEIGHT = 96
 
     def __init__(self):
-        self.array = [[BasicTile() for _ in range(self.WIDTH)] for _ in range(self.HEIGHT)]
+        super().__init__((self.HEIGHT, self.WIDTH))
+
+    @property
+    def array(self):
+        return TileGrid(partial(BasicTile.view, self), self.HEIGHT, self.WIDTH)
+
+    def to_rgb(self):
+        """
+        (HEIGHT, WIDTH, 3) uint8 image of the map, ground in green and water in blue, brighter when higher
+        """
+        return basic_to_rgb(self.type, self.elevation)
 
-    def save_img(self):
+    def save_img(self, fp='map.png', format=None):
         """
         Debug utility to visualize map as image
+        `fp` is a path or a file object, saved as PNG unless `format` or the file extension says otherwise
         """
-        img = Image.new('RGB', (self.WIDTH, self.HEIGHT))
-
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                tile = self.array[y][x]
-                if tile.type == BasicTileType.GROUND:
-                    color = (
-                        tile.elevation * 25,
-                        100 + tile.elevation * 15,
-                        tile.elevation * 25
-                    )
-                else:
-                    color = (
-                        tile.elevation * 25,
-                        tile.elevation * 25,
-                        150 + tile.elevation * 10
-                    )
-
-                img.putpixel((x, y), tuple(color))
-        img.save('map.png')
+        if format is None and not isinstance(fp, (str, os.PathLike)):
+            format = 'PNG'
+        from PIL import Image
+        Image.fromarray(self.to_rgb(), 'RGB').save(fp, format=format)
+
+    def from_rgb(self, rgb):
+        """
+        Load from a (HEIGHT, WIDTH, 3) array, as made by to_rgb
+        Raise ValueError if the array has another shape
+        """
+        rgb = np.asarray(rgb)
+        check_map_rgb(rgb)
+        self.type[...], self.elevation[...] = rgb_to_basic(rgb)
 
     def from_img(self, img):
         """
         Load from PIL image
         Could be use after user modifications from external image-editing tools
         """
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                color = img.getpixel((x, y))
-
-                if color[1] > color[2]:
-                    self.array[y][x].type = BasicTileType.GROUND
-                else:
-                    self.array[y][x].type = BasicTileType.WATER
-                self.array[y][x].elevation = int(round(color[0] / 25))
+        self.from_rgb(image_to_rgb(img))
+
+
+def basic_to_rgb(type, elevation):
+    """
+    Colors of BasicMap.save_img, for arrays of tiles types and elevations
+    """
+    elevation = elevation.astype(np.int32)
+    ground = type == BasicTileType.GROUND.value
+    rgb = np.empty(type.shape + (3,), dtype=np.int32)
+    rgb[..., 0] = elevation * 25
+    rgb[..., 1] = np.where(ground, 100 + elevation * 15, elevation * 25)
+    rgb[..., 2] = np.where(ground, elevation * 25, 150 + elevation * 10)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def rgb_to_basic(rgb):
+    """
+    Tiles types and elevations of an image colored as by basic_to_rgb
+    Returns (type, elevation) uint8 arrays
+    """
+    rgb = np.asarray(rgb, dtype=np.int32)
+    type = np.where(rgb[..., 1] > rgb[..., 2], BasicTileType.GROUND.value, BasicTileType.WATER.value)
+    elevation = np.round(rgb[..., 0] / 25)
+    return type.astype(np.uint8), elevation.astype(np.uint8)
+
+
+def check_map_rgb(rgb):
+    """
+    Raise ValueError if `rgb` is not the (HEIGHT, WIDTH, 3) array of a map image
+    """
+    shape = (BasicMap.HEIGHT, BasicMap.WIDTH, 3)
+    if rgb.shape != shape:
+        if rgb.ndim == 3 and rgb.shape[2] == 3:
+            raise ValueError(f'expected a {BasicMap.WIDTH}x{BasicMap.HEIGHT} image, got {rgb.shape[1]}x{rgb.shape[0]}')
+        raise ValueError(f'expected a {shape} RGB array, got shape {rgb.shape}')
+
+
+def image_to_rgb(img):
+    """
+    (height, width, 3) uint8 array of a PIL image, or of an image file path
+    """
+    from PIL import Image
+    if not isinstance(img, Image.Image):
+        img = Image.open(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.asarray(img)
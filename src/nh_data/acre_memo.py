@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from src.nh_data.matcher import N_LEVELS, match_patterns
+from src.nh_data.pattern_table import NO_MATCH, get_pattern_table
+
+
+ACRE_SIZE = 16
+_OUTSIDE = 2  # type of the tiles padding the map, so that acres on the map edges have their own keys
+
+
+class AcreMemo(object):
+    """
+    Bounded LRU memo of rectified acres, keyed by the content of the acre and of its 1 tile halo
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._table_digest = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def check_table(self, table):
+        """
+        Drops memoized acres computed with another pattern table
+        """
+        if self._table_digest != table.digest:
+            self.clear()
+            self._table_digest = table.digest
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate, 'size': len(self)}
+
+
+_acre_memo = None
+
+
+def get_acre_memo():
+    """
+    Process-wide AcreMemo, shared by all the maps rectified in the process
+    """
+    global _acre_memo
+    if _acre_memo is None:
+        _acre_memo = AcreMemo()
+    return _acre_memo
+
+
+def match_patterns_memoized(ground, elevation, memo, table=None):
+    """
+    Same results as match_patterns for a whole map, computed per acre and reusing acres found in `memo`
+    Acres missing from the memo are matched together, as a stack of their haloed windows
+
+    Returns (entries, levels) arrays of the map size, border tiles being NO_MATCH
+    """
+    if table is None:
+        table = get_pattern_table()
+    memo.check_table(table)
+
+    height, width = ground.shape
+    padded_type = np.pad(ground.astype(np.uint8), 1, constant_values=_OUTSIDE)
+    padded_elevation = np.pad(np.minimum(elevation, N_LEVELS - 1).astype(np.uint8), 1)
+
+    entries = np.full((height, width), NO_MATCH, dtype=np.int16)
+    levels = np.zeros((height, width), dtype=np.uint8)
+
+    missing = []
+    for y in range(0, height, ACRE_SIZE):
+        for x in range(0, width, ACRE_SIZE):
+            window = np.s_[y:y+ACRE_SIZE+2, x:x+ACRE_SIZE+2]
+            key = padded_type[window].tobytes() + padded_elevation[window].tobytes()
+            value = memo.get(key)
+            if value is None:
+                missing.append((y, x, key))
+            else:
+                entries[y:y+ACRE_SIZE, x:x+ACRE_SIZE], levels[y:y+ACRE_SIZE, x:x+ACRE_SIZE] = value
+
+    if missing:
+        windows = [np.s_[y:y+ACRE_SIZE+2, x:x+ACRE_SIZE+2] for y, x, _ in missing]
+        acre_entries, acre_levels = match_patterns(
+            np.stack([padded_type[window] == 1 for window in windows]),
+            np.stack([padded_elevation[window] for window in windows]),
+            table
+        )
+        for (y, x, key), window_entries, window_levels in zip(missing, acre_entries, acre_levels):
+            acre = np.s_[y:y+ACRE_SIZE, x:x+ACRE_SIZE]
+            entries[acre] = window_entries
+            levels[acre] = window_levels
+            _clear_border(entries[acre], levels[acre], y, x, height, width)
+            value = (entries[acre].copy(), levels[acre].copy())
+            for array in value:
+                array.flags.writeable = False
+            memo.put(key, value)
+
+    return entries, levels
+
+
+def _clear_border(entries, levels, y, x, height, width):
+    """
+    Map border tiles of the acre at (y, x) are never matched, they were matched against the padding
+    """
+    for edge, on_border in ((np.s_[0, :], y == 0), (np.s_[-1, :], y + ACRE_SIZE == height),
+                            (np.s_[:, 0], x == 0), (np.s_[:, -1], x + ACRE_SIZE == width)):
+        if on_border:
+            entries[edge] = NO_MATCH
+            levels[edge] = 0
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+MAP_WIDTH = 112
+MAP_HEIGHT = 96
+TILE_SIZE = 14
+MAP_SIZE = MAP_WIDTH * MAP_HEIGHT * TILE_SIZE  # 150528 bytes
+COLUMN_BLOCK = 16  # columns written at once by streaming writers, 21 KB
+
+# One NHSE tile, each field being a little-endian 16 bits word
+# (single byte values are followed by a null byte)
+TILE_DTYPE = np.dtype([
+    ('terrain_type', '<u2'),
+    ('terrain_variation', '<u2'),
+    ('terrain_rotation', '<u2'),
+    ('road_type', '<u2'),
+    ('road_variation', '<u2'),
+    ('road_rotation', '<u2'),
+    ('elevation', '<u2'),
+])
+assert TILE_DTYPE.itemsize == TILE_SIZE
+
+
+def empty_records():
+    """
+    Creates a (HEIGHT, WIDTH) array of blank tiles records
+    """
+    return np.zeros((MAP_HEIGHT, MAP_WIDTH), dtype=TILE_DTYPE)
+
+
+def decode_map(data):
+    """
+    Decode NHSE dump-all format to a (HEIGHT, WIDTH) array of tiles records
+
+    NHSE stores the map column by column, the returned array is a transposed view of the data, nothing is copied
+    `data` can be any object supporting the buffer protocol
+    Raise ValueError if it is not MAP_SIZE bytes long
+    """
+    size = memoryview(data).nbytes
+    if size != MAP_SIZE:
+        raise ValueError(f'expected {MAP_SIZE} bytes, got {size}')
+    records = np.frombuffer(data, dtype=TILE_DTYPE)
+    return records.reshape((MAP_WIDTH, MAP_HEIGHT)).T
+
+
+def encode_map(records):
+    """
+    Encode a (HEIGHT, WIDTH) array of tiles records to NHSE import-all format
+    """
+    assert records.shape == (MAP_HEIGHT, MAP_WIDTH)
+    return records.astype(TILE_DTYPE, copy=False).T.tobytes()
+
+
+def encode_map_into(records, out):
+    """
+    Encode a (HEIGHT, WIDTH) array of tiles records into `out`, a writable buffer of MAP_SIZE bytes
+    (bytearray, memoryview, mmap, shared memory...), without any intermediate copy
+    """
+    assert records.shape == (MAP_HEIGHT, MAP_WIDTH)
+    decode_map(out)[...] = records
+    return out
+
+
+def write_map(records, f):
+    """
+    Encode a (HEIGHT, WIDTH) array of tiles records to NHSE import-all format, streamed to file object `f`
+    Columns are written by blocks of COLUMN_BLOCK, only a block is buffered
+    """
+    assert records.shape == (MAP_HEIGHT, MAP_WIDTH)
+    columns = records.T
+    if columns.flags.c_contiguous and columns.dtype == TILE_DTYPE:  # already in NHSE order, e.g. from decode_map
+        f.write(columns)
+        return
+    block = np.empty((COLUMN_BLOCK, MAP_HEIGHT), dtype=TILE_DTYPE)
+    for start in range(0, MAP_WIDTH, COLUMN_BLOCK):
+        n = min(COLUMN_BLOCK, MAP_WIDTH - start)
+        block[:n] = columns[start:start + n]
+        f.write(block[:n])
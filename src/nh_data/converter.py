@@ -1,9 +1,16 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-import scipy.signal
 
-from src.enums.tile_types import dict_patches
+from src.enums.tile_types import GROUND_LUT
+from src.nh_data.acre_memo import match_patterns_memoized
+from src.nh_data.codec import TILE_DTYPE, encode_map
+from src.nh_data.matcher import N_LEVELS, match_patterns, neighbourhood_bits, find_conflicts
+from src.nh_data.pattern_table import NO_MATCH, get_pattern_table
 from src.nh_data.terrain import NH_Terrain_Map
 from src.internal_data.terrain import BasicMap, BasicTileType
+from src.utils.profiling import profile_stage, profile_count, is_profiling
 
 
 def convert_nhmap_to_basicmap(nh_map: NH_Terrain_Map):
@@ -12,26 +19,196 @@ def convert_nhmap_to_basicmap(nh_map: NH_Terrain_Map):
     """
     basic_map = BasicMap()
 
-    for y in range(basic_map.HEIGHT):
-        letter = chr(ord('A') + (y//16))
-        for x in range(basic_map.WIDTH):
-            digit = x // 16
-            acre = nh_map.acre_dict[f'{letter}{digit}']
-            block = acre.block_array[y % 16][x % 16]
-
-            elevation = block.elevation
-            terrain_type = block.terrain_type
-
-            basic_map.array[y][x].elevation = elevation
-            basic_map.array[y][x].type = BasicTileType.GROUND if terrain_type.is_ground() else BasicTileType.WATER
+    basic_map.elevation[...] = nh_map.elevation
+    basic_map.type[...] = np.where(
+        GROUND_LUT[nh_map.terrain_code], BasicTileType.GROUND.value, BasicTileType.WATER.value
+    )
 
     return basic_map
 
 
-def convert_basicmap_to_rectified_nhmap(basic_map: BasicMap):
+def convert_basicmap_to_rectified_nhmap(basic_map: BasicMap, method='lookup', acre_memo=None, workers=None):
     """
     Converter from Map to NH_Map
+
+    Methods:
+    - lookup: each tile neighbourhood is matched against all patches at once with a precomputed table
+    - correlate: original implementation, correlating each patch over the whole map
+    - threaded: lookup on bands of rows matched in a pool of `workers` threads (cpu count if None), same results
+
+    With the lookup method, an AcreMemo can be given to reuse the results of acres already rectified
+    """
+    if method == 'lookup':
+        return _rectify_lookup(basic_map, acre_memo)
+    if method == 'correlate':
+        return _rectify_correlate(basic_map)
+    if method == 'threaded':
+        return _rectify_threaded(basic_map, workers)
+    raise ValueError(f"unknown rectification method {method!r}")
+
+
+def find_rectification_conflicts(basic_map: BasicMap, table=None):
+    """
+    Tiles of the map whose winning pattern was chosen among several matching ones, by their priority
+    Returns a list of Conflict, see find_conflicts, with positions in map coordinates
+    """
+    if table is None:
+        table = get_pattern_table()
+    ground = basic_map.type == BasicTileType.GROUND.value
+    entries, levels = match_patterns(ground, basic_map.elevation, table)
+    return [
+        conflict._replace(position=(conflict.position[0] + 1, conflict.position[1] + 1))
+        for conflict in find_conflicts(ground, basic_map.elevation, entries, levels, table)
+    ]
+
+
+def profile_winners(entries, table=None):
+    """
+    Records the tiles won by each pattern family (Cliff, River, Fall...) in the `winners` counter of the active
+    profiler, with the tiles nothing matched as `unmatched`
+    The lookup methods match all families at once, so unlike the correlate method they can not be timed apart
+    """
+    if not is_profiling():
+        return
+    if table is None:
+        table = get_pattern_table()
+    matched = entries != NO_MATCH
+    wins = np.bincount(entries[matched] // 4, minlength=len(table.codes))
+    counts = {'unmatched': int(entries.size - np.count_nonzero(matched))}
+    for family, tiles in zip(table.families, wins.tolist()):
+        counts[family] = counts.get(family, 0) + tiles
+    profile_count('winners', counts)
+
+
+def write_matches(nh_map: NH_Terrain_Map, entries, levels, origin=(1, 1), mask=None, table=None):
+    """
+    Writes matcher results to the map, tiles without match being reset to Base at elevation 0
+
+    Results are written starting at `origin`, which is the map interior by default
+    If `mask` is given, only tiles where it is set are written
+    """
+    if table is None:
+        table = get_pattern_table()
+
+    y, x = origin
+    window = np.s_[y:y+entries.shape[0], x:x+entries.shape[1]]
+    if mask is None:
+        # gathered straight into the map arrays, NO_MATCH (-1) wrapping to the blank last entry of the tables
+        np.take(table.entry_codes, entries, out=nh_map.terrain_code[window], mode='wrap')
+        np.take(table.entry_rotations, entries, out=nh_map.terrain_rotation[window], mode='wrap')
+        nh_map.elevation[window] = 0
+        np.copyto(nh_map.elevation[window], levels, where=entries != NO_MATCH)
+    else:
+        entries = entries[mask]
+        nh_map.terrain_code[window][mask] = table.entry_codes[entries]
+        nh_map.terrain_rotation[window][mask] = table.entry_rotations[entries]
+        nh_map.elevation[window][mask] = np.where(entries != NO_MATCH, levels[mask], 0)
+
+
+def rectify_dirty_region(nh_map: NH_Terrain_Map, basic_map: BasicMap, previous_basic_map: BasicMap = None,
+                         dirty=None):
+    """
+    Updates a rectified map after edits of its basic map, only recomputing the tiles whose neighbourhood changed
+
+    Edited tiles are found by comparing `basic_map` with `previous_basic_map`, and/or given as a `dirty`
+    (y_start, x_start, y_stop, x_stop) rectangle, stop excluded
+    nh_map is modified in place and returned
     """
+    if previous_basic_map is None and dirty is None:
+        raise ValueError("either previous_basic_map or dirty must be given")
+
+    height, width = basic_map.HEIGHT, basic_map.WIDTH
+    edited = np.zeros((height, width), dtype=bool)
+    if previous_basic_map is not None:
+        # elevations above the last level all give the same neighbourhood keys
+        edited |= basic_map.type != previous_basic_map.type
+        edited |= (np.minimum(basic_map.elevation, N_LEVELS - 1)
+                   != np.minimum(previous_basic_map.elevation, N_LEVELS - 1))
+    if dirty is not None:
+        y_start, x_start, y_stop, x_stop = dirty
+        edited[max(y_start, 0):y_stop, max(x_start, 0):x_stop] = True
+
+    # interior tiles having an edited tile in their 3x3 neighbourhood
+    affected = neighbourhood_bits(edited) != 0
+    ys, xs = np.nonzero(affected)
+    if len(ys) == 0:
+        return nh_map
+    y_start, y_stop = ys.min(), ys.max() + 1
+    x_start, x_stop = xs.min(), xs.max() + 1
+
+    # match the bounding box of affected tiles, with its 1 tile halo
+    window = np.s_[y_start:y_stop+2, x_start:x_stop+2]
+    entries, levels = match_patterns(
+        basic_map.type[window] == BasicTileType.GROUND.value,
+        basic_map.elevation[window]
+    )
+    write_matches(nh_map, entries, levels, origin=(y_start + 1, x_start + 1),
+                  mask=affected[y_start:y_stop, x_start:x_stop])
+    return nh_map
+
+
+def rectify_stack(ground, elevation, table=None):
+    """
+    Rectifies N maps at once, given as (N, HEIGHT, WIDTH) stacks of ground masks and elevations
+
+    All maps are matched in a single vectorized pass
+    Returns a (N, HEIGHT, WIDTH) array of TILE_DTYPE records, to be encoded by encode_map
+    """
+    if table is None:
+        table = get_pattern_table()
+
+    entries, levels = match_patterns(ground, elevation, table)
+    profile_winners(entries, table)
+
+    records = np.zeros(ground.shape, dtype=TILE_DTYPE)
+    interior = records[:, 1:-1, 1:-1]
+    interior['terrain_type'] = table.entry_codes[entries]
+    interior['terrain_rotation'] = table.entry_rotations[entries]
+    interior['elevation'] = np.where(entries != NO_MATCH, levels, 0)
+    return records
+
+
+def convert_basicmaps_to_rectified_nhmaps(basic_maps, encode=False):
+    """
+    convert_basicmap_to_rectified_nhmap of several maps, rectified together by rectify_stack
+    Returns the NH_Terrain_Map of each map, or their NHSE import-all content if `encode` is set
+    """
+    records = rectify_stack(
+        np.stack([basic_map.type == BasicTileType.GROUND.value for basic_map in basic_maps]),
+        np.stack([basic_map.elevation for basic_map in basic_maps])
+    )
+    if encode:
+        return [encode_map(island_records) for island_records in records]
+
+    nh_maps = []
+    for island_records in records:
+        nh_map = NH_Terrain_Map()
+        nh_map.load_records(island_records)
+        nh_maps.append(nh_map)
+    return nh_maps
+
+
+def _rectify_lookup(basic_map: BasicMap, acre_memo=None):
+    nh_map = NH_Terrain_Map()
+    ground = basic_map.type == BasicTileType.GROUND.value
+    if acre_memo is None:
+        with profile_stage('match_patterns'):
+            entries, levels = match_patterns(ground, basic_map.elevation)
+        profile_winners(entries)
+        with profile_stage('write_matches'):
+            write_matches(nh_map, entries, levels)
+    else:
+        with profile_stage('match_patterns_memoized'):
+            entries, levels = match_patterns_memoized(ground, basic_map.elevation, acre_memo)
+        profile_winners(entries[1:-1, 1:-1])  # the memo also gives the blank border
+        with profile_stage('write_matches'):
+            write_matches(nh_map, entries, levels, origin=(0, 0))
+    return nh_map
+
+
+def _rectify_correlate(basic_map: BasicMap):
+    import scipy.signal  # only needed by this legacy method, slow to import
+
     nh_map = NH_Terrain_Map()
 
     array_types = np.array([
@@ -56,55 +233,84 @@ def convert_basicmap_to_rectified_nhmap(basic_map: BasicMap):
     mask_map_edges[:, 0] = 0
     mask_map_edges[:, basic_map.WIDTH-1] = 0
 
-    for terrain_type, (kernel_type, kernel_elevation) in dict_patches.items():
+    table = get_pattern_table()
+
+    for p, terrain_type in enumerate(table.terrain_types):
+        with profile_stage(f'correlate.{table.families[p]}'):
 
-        thr_elev = np.sum(kernel_elevation[kernel_elevation > 0])
-        thr_type = len(np.nonzero(kernel_type[kernel_type != 0])[0])
+            thr_elev = table.thr_elevation[p]
+            thr_type = table.thr_type[p]
 
-        for rotation in range(4):
-            # create mask for right tiles type
-            corr_type = scipy.signal.correlate2d(array_types, kernel_type, mode="same")
-            corr_type[corr_type < thr_type] = 0
-            corr_type[corr_type >= thr_type] = 1
+            for rotation in range(4):
+                kernel_type = table.kernels_type[p, rotation]
+                kernel_elevation = table.kernels_elevation[p, rotation]
 
-            if np.sum(corr_type) == 0:
-                kernel_type = np.rot90(kernel_type)
-                kernel_elevation = np.rot90(kernel_elevation)
-                continue
+                # create mask for right tiles type
+                corr_type = scipy.signal.correlate2d(array_types, kernel_type, mode="same")
+                corr_type[corr_type < thr_type] = 0
+                corr_type[corr_type >= thr_type] = 1
 
-            for elevation in range(0, 7):
-                if not isinstance(elevation, int):  # weird glitch when debugging, unnecessary on normal runtime
-                    break
-                # select specific elevation
-                ael2 = array_elevations.copy()
-                ael2[array_elevations < elevation] = 0
-                ael2[array_elevations >= elevation] = 1
+                if np.sum(corr_type) == 0:
+                    continue
 
-                # create mask for right tiles elevation
-                matches = scipy.signal.correlate2d(ael2, kernel_elevation, mode="same")
-                matches[matches < thr_elev] = 0
+                for elevation in range(0, 7):
+                    if not isinstance(elevation, int):  # weird glitch when debugging, unnecessary on normal runtime
+                        break
+                    # select specific elevation
+                    ael2 = array_elevations.copy()
+                    ael2[array_elevations < elevation] = 0
+                    ael2[array_elevations >= elevation] = 1
 
-                matches[corr_type == 0] = 0  # remove wrong types
-                matches[mask_map_edges == 0] = 0  # remove edges
+                    # create mask for right tiles elevation
+                    matches = scipy.signal.correlate2d(ael2, kernel_elevation, mode="same")
+                    matches[matches < thr_elev] = 0
 
-                list_x, list_y = np.nonzero(matches)
-                for (y, x) in list(zip(list_x, list_y)):
+                    matches[corr_type == 0] = 0  # remove wrong types
+                    matches[mask_map_edges == 0] = 0  # remove edges
 
-                    letter = chr(ord('A') + (y // 16))
-                    digit = x // 16
-                    acre = nh_map.acre_dict[f'{letter}{digit}']
-                    block = acre.block_array[y % 16][x % 16]
+                    list_x, list_y = np.nonzero(matches)
+                    for (y, x) in list(zip(list_x, list_y)):
 
-                    if block.elevation > elevation:
-                        continue
+                        letter = chr(ord('A') + (y // 16))
+                        digit = x // 16
+                        acre = nh_map.acre_dict[f'{letter}{digit}']
+                        block = acre.block_array[y % 16][x % 16]
 
-                    block.terrain_type = terrain_type
-                    block.terrain_rotation = rotation
-                    block.elevation = elevation
+                        if block.elevation > elevation:
+                            continue
 
-            kernel_type = np.rot90(kernel_type)
-            kernel_elevation = np.rot90(kernel_elevation)
+                        block.terrain_type = terrain_type
+                        block.terrain_rotation = rotation
+                        block.elevation = elevation
 
     return nh_map
 
 
+MIN_BAND_ROWS = 8  # smaller bands cost more in overhead than they save
+
+
+def _rectify_threaded(basic_map: BasicMap, workers=None):
+    nh_map = NH_Terrain_Map()
+    ground = basic_map.type == BasicTileType.GROUND.value
+    elevation = basic_map.elevation
+
+    # interior rows split in bands, each matched with its 1 tile halo and written to its own rows
+    rows = basic_map.HEIGHT - 2
+    n_bands = max(1, min(workers or os.cpu_count() or 1, rows // MIN_BAND_ROWS))
+    bounds = np.linspace(0, rows, n_bands + 1).astype(int)
+
+    def match_band(start, stop):
+        entries, levels = match_patterns(ground[start:stop+2], elevation[start:stop+2])
+        write_matches(nh_map, entries, levels, origin=(start + 1, 1))
+        return entries
+
+    with profile_stage('threaded.match_patterns'):
+        if n_bands == 1:
+            band_entries = [match_band(0, rows)]
+        else:
+            with ThreadPoolExecutor(max_workers=n_bands) as executor:
+                futures = [executor.submit(match_band, start, stop) for start, stop in zip(bounds, bounds[1:])]
+                band_entries = [future.result() for future in futures]
+    for entries in band_entries:  # counted from this thread, profilers are not thread safe
+        profile_winners(entries)
+    return nh_map
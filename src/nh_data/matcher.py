@@ -0,0 +1,208 @@
+from collections import namedtuple
+
+import numpy as np
+
+from src.nh_data.pattern_table import NO_MATCH, get_pattern_table
+
+
+N_LEVELS = 7  # elevations handled by the rectifier, 0 to 6
+
+
+def neighbourhood_bits(mask):
+    """
+    9 bits key of the 3x3 neighbourhood of each tile of `mask` (..., H, W), border tiles excluded
+    Returns a (..., H-2, W-2) uint32 array
+    """
+    h, w = mask.shape[-2:]
+    keys = np.empty(mask.shape[:-2] + (h - 2, w - 2), dtype=np.uint32)
+    bit_values = np.empty(keys.shape, dtype=np.uint32)
+    np.copyto(keys, mask[..., 0:h-2, 0:w-2])
+    for bit in range(1, 9):
+        dy, dx = divmod(bit, 3)
+        np.multiply(mask[..., dy:h-2+dy, dx:w-2+dx], np.uint32(1 << bit), out=bit_values)
+        keys |= bit_values
+    return keys
+
+
+def elevation_keys(elevation, levels, positions=None):
+    """
+    Elevation bits of the neighbourhood keys of each tile of `elevation` (..., H, W) at each of `levels`,
+    shifted to their place in the keys: returns a (len(levels), ..., H-2, W-2) uint32 array, border tiles excluded
+    If flat `positions` of tiles in that interior are given, keys are only computed for them, as a
+    (len(levels), len(positions)) array, `elevation` having to be C contiguous
+
+    The `elevation >= level` masks of all levels are computed once, as a single boolean stack
+    """
+    h, w = elevation.shape[-2:]
+    thresholds = np.array(levels, dtype=elevation.dtype)
+    if positions is None:
+        keys = neighbourhood_bits(elevation >= thresholds.reshape((-1,) + (1,) * elevation.ndim))
+    else:
+        # elevations of the 3x3 neighbours of each position, gathered once, then compared with all levels at once
+        island, interior = np.divmod(positions, (h - 2) * (w - 2))
+        corners = island * (h * w) + interior // (w - 2) * w + interior % (w - 2)
+        offsets = (np.arange(3)[:, np.newaxis] * w + np.arange(3)).ravel()
+        neighbours = np.take(elevation, offsets[:, np.newaxis] + corners)
+        keys = np.zeros((len(levels), len(positions)), dtype=np.uint32)
+        above = np.empty(keys.shape, dtype=bool)
+        bit_values = np.empty(keys.shape, dtype=np.uint32)
+        for bit in range(9):
+            np.greater_equal(neighbours[bit], thresholds[:, np.newaxis], out=above)
+            np.multiply(above, np.uint32(1 << bit), out=bit_values)
+            keys |= bit_values
+    keys <<= 9
+    return keys
+
+
+def keys_at_levels(type_keys, elevation, levels):
+    """
+    18 bits key of the neighbourhood of each tile at its own elevation level, `levels` having the shape of `type_keys`
+    """
+    distinct_levels = np.unique(levels)
+    level_keys = elevation_keys(elevation, distinct_levels.tolist())
+    index = np.searchsorted(distinct_levels, levels)
+    return type_keys | np.take_along_axis(level_keys, index[np.newaxis], axis=0)[0]
+
+
+def present_levels(elevation):
+    """
+    Elevation levels at which a tile of `elevation` can win, from the highest
+
+    The mask `elevation >= level` is the same for all levels between two consecutive elevations of the map,
+    so only the highest of them can win: the elevations present in the map, and the top level
+    """
+    counts = np.bincount(np.minimum(elevation, N_LEVELS - 1).ravel(), minlength=N_LEVELS)
+    return sorted(set(np.flatnonzero(counts).tolist()) | {N_LEVELS - 1}, reverse=True)
+
+
+def uniform_neighbourhood(mask):
+    """
+    Whether the 3x3 neighbourhood of each tile of `mask` (..., H, W) has a single value, border tiles excluded
+    """
+    h, w = mask.shape[-2:]
+    center = mask[..., 1:h-1, 1:w-1]
+    uniform = np.ones(center.shape, dtype=bool)
+    for bit in range(9):
+        dy, dx = divmod(bit, 3)
+        uniform &= mask[..., dy:h-2+dy, dx:w-2+dx] == center
+    return uniform
+
+
+_uniform_winners = {}
+
+
+def uniform_winners(table):
+    """
+    (entries, levels) arrays of the winner of a tile whose neighbourhood is all of the same type and elevation,
+    indexed by [is ground, elevation]
+    """
+    if table.digest not in _uniform_winners:
+        entries = np.full((2, N_LEVELS), NO_MATCH, dtype=np.int16)
+        levels = np.zeros((2, N_LEVELS), dtype=np.uint8)
+        for ground in range(2):
+            for elevation in range(N_LEVELS):
+                for level in range(N_LEVELS - 1, -1, -1):
+                    key = (0x1FF if ground else 0) | (0x1FF << 9 if elevation >= level else 0)
+                    if table.lut[key] != NO_MATCH:
+                        entries[ground, elevation], levels[ground, elevation] = table.lut[key], level
+                        break
+        _uniform_winners[table.digest] = (entries, levels)
+    return _uniform_winners[table.digest]
+
+
+def match_levels(type_keys, level_keys, levels_to_match, table):
+    """
+    Winning entry and level of each type key, `level_keys` holding the elevation keys of each of `levels_to_match`
+    Higher levels override lower ones; the key and result buffers are allocated once and reused for every level
+
+    Returns (entries, levels) arrays of the shape of `type_keys`, entries being NO_MATCH where nothing matched
+    """
+    entries = np.full(type_keys.shape, NO_MATCH, dtype=np.int16)
+    levels = np.zeros(type_keys.shape, dtype=np.uint8)
+    keys = np.empty(type_keys.shape, dtype=np.intp)  # the index type of np.take, which would convert others
+    level_entries = np.empty(type_keys.shape, dtype=np.int16)
+    matched = np.empty(type_keys.shape, dtype=bool)
+    for i in np.argsort(levels_to_match):
+        np.bitwise_or(type_keys, level_keys[i], out=keys)
+        np.take(table.lut, keys, out=level_entries)
+        np.not_equal(level_entries, NO_MATCH, out=matched)
+        np.copyto(entries, level_entries, where=matched)
+        np.copyto(levels, levels_to_match[i], where=matched)
+    return entries, levels
+
+
+def match_patterns(ground, elevation, table=None):
+    """
+    Finds the winning pattern of each tile of (..., H, W) `ground` and `elevation` arrays, border tiles excluded
+
+    The winner is the entry matching at the highest elevation level, then the highest priority entry of the table
+    Only levels of present_levels are looked up, with the elevation keys of all of them computed at once
+    Tiles whose neighbourhood is uniform get the winner of their type and elevation in bulk, then the band of
+    tiles along type and elevation changes is looked up by match_levels
+
+    Returns (entries, levels) arrays of shape (..., H-2, W-2), entries being NO_MATCH where nothing matched
+    """
+    if table is None:
+        table = get_pattern_table()
+
+    # flat indices and views below need C order arrays, decode_map fields for instance are transposed views
+    ground = np.ascontiguousarray(ground)
+    elevation = np.ascontiguousarray(np.minimum(elevation, N_LEVELS - 1))
+    h, w = ground.shape[-2:]
+    levels_to_match = present_levels(elevation)
+
+    type_keys = neighbourhood_bits(ground)
+    uniform = uniform_neighbourhood(elevation) & ((type_keys == 0) | (type_keys == 0x1FF))
+    pending = np.flatnonzero(~uniform)
+
+    if pending.size * 2 > uniform.size:
+        # most tiles are on the band, looking up whole arrays is cheaper than gathering the band
+        return match_levels(type_keys, elevation_keys(elevation, levels_to_match), levels_to_match, table)
+
+    winner_entries, winner_levels = uniform_winners(table)
+    interior_ground = ground[..., 1:h-1, 1:w-1].astype(np.intp)
+    interior_elevation = elevation[..., 1:h-1, 1:w-1]
+    entries = winner_entries[interior_ground, interior_elevation]
+    levels = winner_levels[interior_ground, interior_elevation]
+
+    if pending.size:
+        # keys of the band tiles are gathered once for all levels, and their results scattered back
+        band_entries, band_levels = match_levels(
+            type_keys.ravel()[pending], elevation_keys(elevation, levels_to_match, pending), levels_to_match, table
+        )
+        entries.ravel()[pending] = band_entries
+        levels.ravel()[pending] = band_levels
+    return entries, levels
+
+
+Conflict = namedtuple('Conflict', ['position', 'winner', 'candidates'])
+
+
+def find_conflicts(ground, elevation, entries, levels, table=None):
+    """
+    Tiles whose winning neighbourhood key is matched by several distinct patterns, see PatternTable.pattern_counts
+    `entries` and `levels` are the match_patterns results of `ground` and `elevation`
+
+    Returns a list of Conflict, with the position of the tile in the matcher results,
+    and the TerrainType of the winner and of all the matching patterns, by decreasing priority
+    """
+    if table is None:
+        table = get_pattern_table()
+
+    elevation = np.minimum(elevation, N_LEVELS - 1)
+    keys = keys_at_levels(neighbourhood_bits(ground), elevation, levels)
+
+    conflicts = []
+    conflicting = (entries != NO_MATCH) & (table.pattern_counts[keys] > 1)
+    for position in zip(*np.nonzero(conflicting)):
+        key = int(keys[position])
+        patterns = []
+        for entry in table.matching_entries(key):
+            if entry // 4 not in patterns:
+                patterns.append(entry // 4)
+        conflicts.append(Conflict(
+            tuple(int(i) for i in position),
+            table.terrain_types[entries[position] // 4],
+            [table.terrain_types[p] for p in patterns],
+        ))
+    return conflicts
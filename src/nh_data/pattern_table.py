@@ -0,0 +1,247 @@
+import hashlib
+import os
+import re
+import tempfile
+import zipfile
+
+import numpy as np
+
+from src.enums.tile_types import TERRAIN_CODES, dict_patches
+
+
+TABLE_VERSION = 3  # bump when the table layout or the compilation rules change
+KEY_BITS = 18  # 9 bits of tile types + 9 bits of elevation mask, for a 3x3 neighbourhood
+NO_MATCH = -1
+ORDERS = ('patches', 'specificity')  # priority rules of PatternTable.compile
+
+_ARRAYS = (
+    'codes', 'kernels_type', 'kernels_elevation', 'thr_type', 'thr_elevation',
+    'specificity', 'priorities', 'care', 'required', 'lut', 'pattern_counts',
+)
+
+
+def required_bits(kernel):
+    """
+    Converts a 3x3 kernel of 1 / -1 / 0 values to (care, required) 9 bits masks
+    Bit 3*u + v stands for kernel cell [u, v]
+    """
+    flat = np.asarray(kernel).reshape(9)
+    bits = 1 << np.arange(9)
+    care = int(np.sum(bits[flat != 0]))
+    required = int(np.sum(bits[flat > 0]))
+    return care, required
+
+
+def matching_keys(care, required, key_bits=KEY_BITS):
+    """
+    All keys of `key_bits` bits equal to `required` on `care` bits
+    """
+    free_bits = [b for b in range(key_bits) if not care & (1 << b)]
+    subsets = np.arange(1 << len(free_bits), dtype=np.uint32)
+    keys = np.full(len(subsets), required, dtype=np.uint32)
+    for i, b in enumerate(free_bits):
+        keys |= ((subsets >> i) & 1) << b
+    return keys
+
+
+def patches_digest(patches, order='patches'):
+    """
+    Hash of the patches content, of the priority order and of TABLE_VERSION, identifying a compiled table
+    """
+    h = hashlib.sha256(f'v{TABLE_VERSION}:{order}'.encode())
+    for terrain_type, (kernel_type, kernel_elevation) in patches.items():
+        h.update(terrain_type.name.encode() + terrain_type.value)
+        h.update(np.asarray(kernel_type, dtype=np.int8).tobytes())
+        h.update(np.asarray(kernel_elevation, dtype=np.int8).tobytes())
+    return h.hexdigest()
+
+
+class PatternTable(object):
+    """
+    dict_patches compiled for the rectifier
+
+    Entry `4 * pattern + rotation` is the pattern kernels rotated `rotation` times by np.rot90
+    An entry matches a neighbourhood key when `key & care == required`
+
+    Priorities: when several entries match the same key, the one with the highest priority wins
+    `specificity` of an entry is the number of neighbourhood bits its kernels care about
+    Priorities are ranked by the `order` given to compile:
+    - patches: the patches order only, later patches winning as in the original rectifier (the default)
+    - specificity: the most specific entry wins, ties being broken by the patches order
+    With dict_patches, the orders only differ on the keys matched by both Fall201 and Fall205, or Fall301 and Fall305
+    The lookup table gives, for each key, the winning entry at that elevation level
+    `pattern_counts` gives the number of distinct patterns matching each key, more than one being a conflict
+    """
+    def __init__(self, digest, arrays):
+        self.digest = digest
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.terrain_types = [TERRAIN_CODES.member(code) for code in self.codes]
+        # code and rotation of each entry, followed by those of NO_MATCH tiles (Base, rotation 0)
+        self.entry_codes = np.append(np.repeat(self.codes, 4), np.uint16(0))
+        self.entry_rotations = np.append(np.tile(np.arange(4, dtype=np.uint8), len(self.codes)), np.uint8(0))
+        # Cliff, River, Fall... name of the patterns without their shape
+        self.families = [re.match(r'[A-Za-z]+?(?=\d|$)', t.name).group() for t in self.terrain_types]
+
+    @classmethod
+    def compile(cls, patches, order='patches'):
+        """
+        Builds the table from a dict of patches, with priorities ranked by `order`, one of ORDERS
+        """
+        if order not in ORDERS:
+            raise ValueError(f"unknown priority order {order!r}")
+        n = len(patches)
+        arrays = {
+            'codes': np.array([TERRAIN_CODES.code(t) for t in patches], dtype=np.uint16),
+            'kernels_type': np.zeros((n, 4, 3, 3), dtype=np.int8),
+            'kernels_elevation': np.zeros((n, 4, 3, 3), dtype=np.int8),
+            'thr_type': np.zeros(n, dtype=np.int8),
+            'thr_elevation': np.zeros(n, dtype=np.int8),
+            'specificity': np.zeros(4 * n, dtype=np.uint8),
+            'priorities': np.zeros(4 * n, dtype=np.int16),
+            'care': np.zeros(4 * n, dtype=np.uint32),
+            'required': np.zeros(4 * n, dtype=np.uint32),
+            'lut': np.full(1 << KEY_BITS, NO_MATCH, dtype=np.int16),
+            'pattern_counts': np.zeros(1 << KEY_BITS, dtype=np.uint8),
+        }
+
+        for p, (kernel_type, kernel_elevation) in enumerate(patches.values()):
+            arrays['thr_type'][p] = np.count_nonzero(kernel_type)
+            arrays['thr_elevation'][p] = np.sum(kernel_elevation[kernel_elevation > 0])
+            for rotation in range(4):
+                arrays['kernels_type'][p, rotation] = np.rot90(kernel_type, rotation)
+                arrays['kernels_elevation'][p, rotation] = np.rot90(kernel_elevation, rotation)
+
+        for entry in range(4 * n):
+            care_type, required_type = required_bits(arrays['kernels_type'][entry // 4, entry % 4])
+            care_elevation, required_elevation = required_bits(arrays['kernels_elevation'][entry // 4, entry % 4])
+            arrays['care'][entry] = care_type | care_elevation << 9
+            arrays['required'][entry] = required_type | required_elevation << 9
+            arrays['specificity'][entry] = bin(int(arrays['care'][entry])).count('1')
+
+        entries_order = np.arange(4 * n)
+        if order == 'specificity':
+            entries_order = np.lexsort((entries_order, arrays['specificity']))
+        arrays['priorities'][entries_order] = np.arange(4 * n)
+
+        # writing entries by increasing priority leaves the winner of each key
+        for entry in np.argsort(arrays['priorities'], kind='stable'):
+            keys = matching_keys(int(arrays['care'][entry]), int(arrays['required'][entry]))
+            arrays['lut'][keys] = entry
+
+        for p in range(n):
+            matched = np.zeros(1 << KEY_BITS, dtype=bool)
+            for entry in range(4 * p, 4 * p + 4):
+                matched[matching_keys(int(arrays['care'][entry]), int(arrays['required'][entry]))] = True
+            arrays['pattern_counts'] += matched
+
+        return cls(patches_digest(patches, order), arrays)
+
+    def matching_entries(self, key):
+        """
+        All entries matching a neighbourhood key, by decreasing priority
+        """
+        entries = np.nonzero((key & self.care) == self.required)[0]
+        return entries[np.argsort(-self.priorities[entries], kind='stable')]
+
+    def save(self, path):
+        """
+        Saves the table as an uncompressed .npz, so that it can be memory-mapped by `load`
+        """
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, digest=np.array(self.digest), **{name: getattr(self, name) for name in _ARRAYS})
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a table saved by `save`, arrays are read-only memory maps of the file
+        """
+        arrays = _mmap_npz(path)
+        return cls(str(arrays.pop('digest')), arrays)
+
+
+def _mmap_npz(path):
+    """
+    Memory-maps every member of an uncompressed .npz file
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: {info.filename} is compressed and can not be memory-mapped")
+
+            # member data starts after its local header, which has variable length name and extra fields
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            name = info.filename[:-len('.npy')]
+            if shape == ():
+                arrays[name] = np.fromfile(f, dtype=dtype, count=1).reshape(())
+            else:
+                arrays[name] = np.memmap(
+                    path, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C'
+                )
+    return arrays
+
+
+def default_cache_dir():
+    """
+    Directory of the compiled tables cache, NHSE_HELPER_CACHE_DIR if set
+    """
+    if os.environ.get('NHSE_HELPER_CACHE_DIR'):
+        return os.environ['NHSE_HELPER_CACHE_DIR']
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'nhse_helper')
+
+
+def load_pattern_table(patches, cache_dir=None, order='patches'):
+    """
+    Loads the compiled table of `patches` from the cache, compiling and caching it when missing or outdated
+
+    Files are named after the patches digest, so editing dict_patches or TABLE_VERSION invalidates them
+    The table is still returned if the cache can not be read or written
+    """
+    digest = patches_digest(patches, order)
+    path = os.path.join(cache_dir or default_cache_dir(), f'patterns-v{TABLE_VERSION}-{digest[:16]}.npz')
+
+    try:
+        table = PatternTable.load(path)
+        if table.digest == digest:
+            return table
+    except (OSError, ValueError, zipfile.BadZipFile):
+        pass
+
+    table = PatternTable.compile(patches, order)
+    try:
+        table.save(path)
+    except OSError:
+        pass
+    return table
+
+
+_pattern_table = None
+
+
+def get_pattern_table():
+    """
+    PatternTable of dict_patches, loaded once per process
+    """
+    global _pattern_table
+    if _pattern_table is None:
+        _pattern_table = load_pattern_table(dict_patches)
+    return _pattern_table
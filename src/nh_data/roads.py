@@ -0,0 +1,85 @@
+import re
+
+import numpy as np
+
+from src.enums.tile_types import ROAD_CODES, RoadType, dict_road_patches
+from src.nh_data.pattern_table import NO_MATCH, required_bits, matching_keys
+from src.nh_data.terrain import NH_Terrain_Map
+
+
+ROAD_MATERIALS = ['Soil', 'Stone', 'Brick', 'DarkSoil', 'FanPattern', 'Sand', 'Tile', 'Wood']
+NO_ROAD = -1
+
+_ROAD_NAME = re.compile(r'Road([A-Za-z]+)(\d[A-C])$')
+
+
+class RoadTable(object):
+    """
+    dict_road_patches compiled for the road rectifier
+
+    Road shapes reuse the River kernels negated: a river shape is water surrounded by ground,
+    a road shape is road surrounded by tiles of the same material
+
+    Entry `4 * shape + rotation` is the shape kernel rotated `rotation` times by np.rot90
+    The lookup table gives, for each 9 bits key of same-material neighbours, the winning entry
+    """
+    def __init__(self, road_patches):
+        self.shapes = list(road_patches.keys())
+
+        # material of each member of ROAD_CODES
+        self.materials = np.full(len(ROAD_CODES.members), NO_ROAD, dtype=np.int8)
+        for index, member in enumerate(ROAD_CODES.members):
+            match = _ROAD_NAME.match(member.name)
+            if match:
+                self.materials[index] = ROAD_MATERIALS.index(match.group(1))
+
+        # code of each (material, shape)
+        self.codes = np.array([
+            [ROAD_CODES.code(RoadType[f'Road{material}{shape}']) for shape in self.shapes]
+            for material in ROAD_MATERIALS
+        ], dtype=np.uint16)
+
+        # later entries override earlier ones, like for terrain patches
+        self.lut = np.full(1 << 9, NO_MATCH, dtype=np.int16)
+        for s, kernel in enumerate(road_patches.values()):
+            for rotation in range(4):
+                care, required = required_bits(np.rot90(kernel, rotation))
+                self.lut[matching_keys(care, required, key_bits=9)] = 4 * s + rotation
+
+
+_road_table = None
+
+
+def get_road_table():
+    """
+    RoadTable of dict_road_patches, compiled on first use
+    """
+    global _road_table
+    if _road_table is None:
+        _road_table = RoadTable(dict_road_patches)
+    return _road_table
+
+
+def rectify_roads(nh_map: NH_Terrain_Map):
+    """
+    Sets the shape and rotation of all roads, from the roads of the same material around them
+
+    Only the material of the painted roads matters, whatever their current shape is
+    Tiles out of the map count as having no road
+    nh_map is modified in place and returned
+    """
+    table = get_road_table()
+    materials = table.materials[ROAD_CODES.decode(nh_map.road_code)]
+
+    height, width = materials.shape
+    padded = np.pad(materials, 1, constant_values=NO_ROAD)
+    keys = np.zeros((height, width), dtype=np.uint16)
+    for bit in range(9):
+        dy, dx = divmod(bit, 3)
+        keys |= (padded[dy:dy+height, dx:dx+width] == materials).astype(np.uint16) << bit
+
+    entries = table.lut[keys]
+    roads = (materials != NO_ROAD) & (entries != NO_MATCH)
+    nh_map.road_code[roads] = table.codes[materials[roads], entries[roads] // 4]
+    nh_map.road_rotation[roads] = entries[roads] % 4
+    return nh_map
@@ -1,81 +1,194 @@
-from src.enums.tile_types import TerrainType, RoadType
+import mmap
+import traceback
+from contextlib import contextmanager
+from functools import partial
+
+import numpy as np
+
+from src.enums.tile_types import TerrainType, TERRAIN_CODES, ROAD_CODES
+from src.nh_data.codec import TILE_DTYPE, COLUMN_BLOCK, decode_map, encode_map, empty_records
+from src.utils.grid import TileGrid
+
+
+# Columns of the terrain model, with their dtype and the NHSE record field they are stored in
+TERRAIN_FIELDS = {
+    'elevation': (np.uint8, 'elevation'),
+    'terrain_code': (np.uint16, 'terrain_type'),
+    'terrain_variation': (np.uint8, 'terrain_variation'),
+    'terrain_rotation': (np.uint8, 'terrain_rotation'),
+    'road_code': (np.uint16, 'road_type'),
+    'road_variation': (np.uint8, 'road_variation'),
+    'road_rotation': (np.uint8, 'road_rotation'),
+}
+
+class _TerrainArrays(object):
+    """
+    Columnar storage of tiles, one numpy array per field of TERRAIN_FIELDS
+    Maps own their arrays, acres and tiles are views on them
+    """
+    def __init__(self, shape, arrays=None):
+        if arrays is None:
+            arrays = {name: np.zeros(shape, dtype=dtype) for name, (dtype, _) in TERRAIN_FIELDS.items()}
+        for name in TERRAIN_FIELDS:
+            setattr(self, name, arrays[name])
+
+    def view_arrays(self, key):
+        """
+        Views of all fields arrays at `key`
+        """
+        return {name: getattr(self, name)[key] for name in TERRAIN_FIELDS}
+
+    def to_records(self, records=None):
+        """
+        Encode tiles as an array of TILE_DTYPE records
+        Records are written into `records` if given
+        """
+        if records is None:
+            records = np.zeros(self.elevation.shape, dtype=TILE_DTYPE)
+        for name, (_, field) in TERRAIN_FIELDS.items():
+            records[field] = getattr(self, name)
+        return records
+
+    def load_records(self, records):
+        """
+        Decode tiles from an array of TILE_DTYPE records
+        """
+        TERRAIN_CODES.decode(records['terrain_type'])
+        ROAD_CODES.decode(records['road_type'])
+        for name, (_, field) in TERRAIN_FIELDS.items():
+            getattr(self, name)[...] = records[field]
+
+
+def _field_property(name):
+    def getter(self):
+        return int(getattr(self._arrays, name)[self._y, self._x])
+
+    def setter(self, value):
+        getattr(self._arrays, name)[self._y, self._x] = value
+
+    return property(getter, setter)
+
+
+def _enum_property(name, code_table):
+    def getter(self):
+        return code_table.member(getattr(self._arrays, name)[self._y, self._x])
+
+    def setter(self, value):
+        getattr(self._arrays, name)[self._y, self._x] = code_table.code(value)
+
+    return property(getter, setter)
 
 
 class NH_Terrain_Tile(object):
+    """
+    Single tile, its fields are read from and written to the arrays of its acre or map
+    """
     def __init__(self):
-        self.elevation = 0
+        self._arrays = _TerrainArrays((1, 1))
+        self._y = 0
+        self._x = 0
+
+    @classmethod
+    def view(cls, arrays, y, x):
+        """
+        Tile backed by position (y, x) of `arrays`
+        """
+        tile = cls.__new__(cls)
+        tile._arrays = arrays
+        tile._y = y
+        tile._x = x
+        return tile
 
-        self.terrain_type = TerrainType.Base
-        self.terrain_variation = 0  # don't know what it is used for
-        self.terrain_rotation = 0
+    elevation = _field_property('elevation')
 
-        # TODO not yet handled beyond load/dump
-        self.road_type = RoadType.Base
-        self.road_variation = 0
-        self.road_rotation = 0
+    terrain_type = _enum_property('terrain_code', TERRAIN_CODES)
+    terrain_variation = _field_property('terrain_variation')  # don't know what it is used for
+    terrain_rotation = _field_property('terrain_rotation')
+
+    road_type = _enum_property('road_code', ROAD_CODES)
+    road_variation = _field_property('road_variation')
+    road_rotation = _field_property('road_rotation')
+
+    def _cell(self):
+        return _TerrainArrays(None, self._arrays.view_arrays(np.s_[self._y:self._y+1, self._x:self._x+1]))
 
     def dump(self):
         """
         Encode tile to NHSE dump format
         """
-        data = self.terrain_type.value
-        data += self.terrain_variation.to_bytes(1, byteorder='big') + b'\x00'
-        data += self.terrain_rotation.to_bytes(1, byteorder='big') + b'\x00'
-
-        # TODO
-        data += self.road_type.value
-        data += self.road_variation.to_bytes(1, byteorder='big') + b'\x00'
-        data += self.road_rotation.to_bytes(1, byteorder='big') + b'\x00'
-
-        data += self.elevation.to_bytes(1, byteorder='big') + b'\x00'
-        return data
+        return self._cell().to_records().tobytes()
 
     def load(self, data):
         """
         Decode tile from NHSE dump
         """
-        self.terrain_type = TerrainType(data[0:2])
-        self.terrain_variation = data[2:4]
-        self.terrain_rotation = int.from_bytes(data[4:5], byteorder='big')
-        self.road_type = RoadType(data[6:8])
-        self.road_variation = data[8:10]
-        self.road_rotation = int.from_bytes(data[10:11], byteorder='big')
-        self.elevation = int.from_bytes(data[12:13], byteorder='big')
+        self._cell().load_records(np.frombuffer(data, dtype=TILE_DTYPE).reshape((1, 1)))
 
 
-class NH_Terrain_Acre(object):
-    def __init__(self):
-        self.block_array = [[NH_Terrain_Tile() for _ in range(16)] for _ in range(16)]
+class NH_Terrain_Acre(_TerrainArrays):
+    def __init__(self, arrays=None):
+        super().__init__((16, 16), arrays)
+
+    @property
+    def block_array(self):
+        return TileGrid(partial(NH_Terrain_Tile.view, self), 16, 16)
 
     def dump(self):
         """
         Encode acre to NHSE single-acre dump format
         """
-        data = b''
-        for y in range(16):
-            for x in range(16):
-                data += self.block_array[y][x].dump()
-        return data
+        return self.to_records().tobytes()
 
     def dump_cols(self):
         """
         Utility to dump all acre in the order NHSE export
         """
-        list_dumps_columns = []
-        for c in range(16):
-            column = b''
-            for y in range(16):
-                column += self.block_array[y][c].dump()
-            list_dumps_columns.append(column)
-        return list_dumps_columns
+        records = self.to_records()
+        return [records[:, c].tobytes() for c in range(16)]
 
 
-class NH_Terrain_Map(object):
-    def __init__(self):
+def _mmap(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextmanager
+def map_file(path):
+    """
+    Read-only memory map of a whole file, closed when leaving the with block
+    Arrays viewing the map must not be kept beyond the block
+    """
+    data = _mmap(path)
+    try:
+        yield data
+    except BaseException as e:
+        traceback.clear_frames(e.__traceback__)  # releases the views held by the frames the error went through
+        raise
+    finally:
+        try:
+            data.close()
+        except BufferError:  # views still referenced by the caller, the map is closed with them
+            pass
+
+
+def load_nht(path):
+    """
+    Memory-maps a NHSE dump-all file, see NH_Terrain_Map.from_buffer
+    The file stays mapped as long as the returned map is referenced
+    """
+    return NH_Terrain_Map.from_buffer(_mmap(path))
+
+
+class NH_Terrain_Map(_TerrainArrays):
+    WIDTH = 112
+    HEIGHT = 96
+
+    def __init__(self, arrays=None):
+        super().__init__((self.HEIGHT, self.WIDTH), arrays)
         self.letters = ['A', 'B', 'C', 'D', 'E', 'F']
         self.acre_dict = {
-            f"{l}{c}": NH_Terrain_Acre()
-            for l in self.letters
+            f"{l}{c}": NH_Terrain_Acre(self.view_arrays(np.s_[16*li:16*(li+1), 16*c:16*(c+1)]))
+            for li, l in enumerate(self.letters)
             for c in range(7)
         }
 
@@ -83,32 +196,47 @@ class NH_Terrain_Map(object):
         """
         Encode map to NHSE import-all format
         """
-        data = b''
-        for c in range(7):
-            dict_dumps = {}
-            for l in ['A', 'B', 'C', 'D', 'E', 'F']:
-                dict_dumps[l] = self.acre_dict[f'{l}{c}'].dump_cols()
-            for x in range(16):
-                for l in ['A', 'B', 'C', 'D', 'E', 'F']:
-                    data += dict_dumps[l].pop(0)
-        return data
+        return encode_map(self.to_records(empty_records()))
+
+    def dump_all_into(self, out):
+        """
+        Encode map to NHSE import-all format into `out`, a writable buffer of MAP_SIZE bytes
+        Fields are written straight to their place in the buffer
+        """
+        self.to_records(decode_map(out))
+        return out
+
+    def write_all(self, f):
+        """
+        Encode map to NHSE import-all format, streamed to file object `f` by blocks of COLUMN_BLOCK columns
+        """
+        block = np.empty((COLUMN_BLOCK, self.HEIGHT), dtype=TILE_DTYPE)
+        for start in range(0, self.WIDTH, COLUMN_BLOCK):
+            n = min(COLUMN_BLOCK, self.WIDTH - start)
+            columns = _TerrainArrays(None, self.view_arrays(np.s_[:, start:start + n]))
+            columns.to_records(block[:n].T)
+            f.write(block[:n])
 
     def load_all(self, data):
         """
         Decode map from NHSE dump-all format
+        Raise UnknownCodeError if the data has invalid terrain or road codes
+        """
+        self.load_records(decode_map(data))
+
+    @classmethod
+    def from_buffer(cls, data):
+        """
+        Map whose fields are views on a NHSE dump-all content, without any copy
+        Raise UnknownCodeError if the content has invalid terrain or road codes
+
+        `data` can be any buffer: bytes, bytearray, memoryview, mmap, shared memory...
+        Fields are read-only if the buffer is, and are uint16 like the dump fields
         """
-        assert len(data) == 150528
-        for letter_index, letter in enumerate(self.letters):
-            offset_y = letter_index * 16
-            for digit in range(7):
-                acre = self.acre_dict[f'{letter}{digit}']
-                offset_x = digit * 16
-
-                for y in range(16):
-                    for x in range(16):
-                        offset = ((offset_y + y) + 96*(offset_x + x))*14
-                        block_data = data[offset:offset+14]
-                        acre.block_array[y][x].load(block_data)
+        records = decode_map(data)
+        TERRAIN_CODES.decode(records['terrain_type'])
+        ROAD_CODES.decode(records['road_type'])
+        return cls({name: records[field] for name, (_, field) in TERRAIN_FIELDS.items()})
 
     def debug_visualize_terrain_type_enum(self):
         """
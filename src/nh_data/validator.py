@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+import numpy as np
+
+from src.enums.tile_types import GROUND_LUT, TERRAIN_CODES, dict_alternatives
+from src.nh_data.matcher import N_LEVELS, neighbourhood_bits, elevation_keys, keys_at_levels, present_levels
+from src.nh_data.pattern_table import NO_MATCH, get_pattern_table
+
+
+ACRE_SIZE = 16
+ACRE_LETTERS = 'ABCDEF'
+
+# actual is the (TerrainType, rotation, elevation) of the tile, TerrainType being None for unknown codes
+# allowed lists the (TerrainType, rotation) whose patterns fit its source neighbourhood at its elevation
+TileError = namedtuple('TileError', ['y', 'x', 'acre', 'actual', 'allowed'])
+
+# code of the alternative accepted in place of each code, the code itself if it has none
+ALTERNATIVE_CODES = np.arange(1 << 16, dtype=np.uint16)
+for _terrain_type, _alternative in dict_alternatives.items():
+    ALTERNATIVE_CODES[TERRAIN_CODES.code(_terrain_type)] = TERRAIN_CODES.code(_alternative)
+
+
+class InconsistentTilesError(ValueError):
+    """
+    Tiles of a rectified map disagreeing with the patterns, `errors` lists their TileError
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        listed = '; '.join(format_tile_error(error) for error in errors[:5])
+        more = f' and {len(errors) - 5} more' if len(errors) > 5 else ''
+        super().__init__(f'{len(errors)} inconsistent tiles: {listed}{more}')
+
+    def __reduce__(self):
+        return type(self), (self.errors,)
+
+
+def acre_name(y, x):
+    return f'{ACRE_LETTERS[y // ACRE_SIZE]}{x // ACRE_SIZE}'
+
+
+def format_tile_error(error):
+    terrain_type, rotation, elevation = error.actual
+    name = terrain_type.name if terrain_type is not None else 'unknown'
+    allowed = ', '.join(f'{t.name} rotation {r}' for t, r in error.allowed[:3]) or 'nothing'
+    if len(error.allowed) > 3:
+        allowed += ', ...'
+    return (f'{error.acre} ({error.y % ACRE_SIZE}, {error.x % ACRE_SIZE}): '
+            f'{name} rotation {rotation} elevation {elevation}, expected {allowed}')
+
+
+_pattern_indices = {}
+
+
+def pattern_indices(table):
+    """
+    Pattern of each terrain code in the table, and pattern of its dict_alternatives, -1 for codes of no pattern
+    """
+    if table.digest not in _pattern_indices:
+        patterns = np.full(1 << 16, -1, dtype=np.int16)
+        patterns[table.codes] = np.arange(len(table.codes))
+        _pattern_indices[table.digest] = (patterns, patterns[ALTERNATIVE_CODES])
+    return _pattern_indices[table.digest]
+
+
+def unmatched_tiles(ground, elevation, table):
+    """
+    Tiles no pattern fits at any elevation level, which the rectifier leaves blank, border tiles excluded
+    """
+    keys = neighbourhood_bits(ground) | elevation_keys(elevation, present_levels(elevation))
+    return (table.lut[keys] == NO_MATCH).all(axis=0)
+
+
+def validate_rectified(nh_map, source_map, table=None):
+    """
+    Checks each tile of a rectified map against the dict_patches rules, in the neighbourhood it was rectified from
+
+    `source_map` is the map given to the rectifier, whose ground mask and elevations are the neighbourhoods
+    The pattern of the tile type (or of its dict_alternatives) rotated as the tile must fit its neighbourhood
+    at the elevation level of the tile; blank tiles (Base, rotation 0, elevation 0) must have no fitting pattern
+    Border tiles, variations and roads are not checked
+    Returns the list of TileError of all inconsistent tiles, empty when the map is consistent
+    """
+    if table is None:
+        table = get_pattern_table()
+    patterns, alternative_patterns = pattern_indices(table)
+
+    ground = GROUND_LUT[source_map.terrain_code]
+    elevation = np.minimum(source_map.elevation, N_LEVELS - 1)
+    codes = nh_map.terrain_code[1:-1, 1:-1]
+    rotations = nh_map.terrain_rotation[1:-1, 1:-1].astype(np.intp)
+    levels = nh_map.elevation[1:-1, 1:-1]
+    keys = keys_at_levels(neighbourhood_bits(ground), elevation, levels)
+
+    consistent = np.zeros(keys.shape, dtype=bool)
+    for candidates in (patterns[codes], alternative_patterns[codes]):
+        valid = (candidates >= 0) & (rotations < 4) & (levels < N_LEVELS)
+        entries = np.where(valid, 4 * candidates + rotations, 0)
+        consistent |= valid & ((keys & table.care[entries]) == table.required[entries])
+    blank = (codes == table.entry_codes[NO_MATCH]) & (rotations == 0) & (levels == 0)
+    if (blank & ~consistent).any():
+        consistent |= blank & unmatched_tiles(ground, elevation, table)
+
+    errors = []
+    for y, x in zip(*np.nonzero(~consistent)):
+        key = int(keys[y, x])
+        y, x = int(y) + 1, int(x) + 1
+        allowed = np.flatnonzero((key & table.care) == table.required)
+        errors.append(TileError(
+            y, x, acre_name(y, x),
+            (_member_or_none(int(nh_map.terrain_code[y, x])),
+             int(nh_map.terrain_rotation[y, x]), int(nh_map.elevation[y, x])),
+            [(table.terrain_types[entry // 4], int(entry % 4)) for entry in allowed],
+        ))
+    return errors
+
+
+def _member_or_none(code):
+    try:
+        return TERRAIN_CODES.member(code)
+    except ValueError:
+        return None
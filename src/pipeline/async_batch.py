@@ -0,0 +1,190 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from src.pipeline.batch import FileResult, DEFAULT_QUEUE_DEPTH, format_error
+from src.pipeline.rectify import rectify_bytes, rectify_image, is_image_path
+
+
+class StageUtilization(object):
+    """
+    Time the tasks of a pipeline stage spent working, waiting for their input and blocked by a full output queue
+    """
+    def __init__(self, name, tasks=1):
+        self.name = name
+        self.tasks = tasks
+        self.items = 0
+        self.busy = 0.
+        self.starved = 0.
+        self.blocked = 0.
+
+    def to_dict(self, wall_time):
+        total = wall_time * self.tasks or 1.
+        return {
+            'items': self.items, 'tasks': self.tasks,
+            'busy': self.busy / total, 'starved': self.starved / total, 'blocked': self.blocked / total,
+        }
+
+
+class PipelineStats(object):
+    """
+    Utilization of the read, rectify and write stages of run_async_batch
+    """
+    def __init__(self):
+        self.stages = {}
+        self.wall_time = 0.
+
+    def to_dict(self):
+        return {name: stage.to_dict(self.wall_time) for name, stage in self.stages.items()}
+
+    def format(self):
+        lines = []
+        for name, stage in self.to_dict().items():
+            lines.append(f"{name}: {stage['items']} files, busy {stage['busy']:.0%}, "
+                         f"waiting input {stage['starved']:.0%}, blocked on output {stage['blocked']:.0%}")
+        return '\n'.join(lines)
+
+
+class _Item(object):
+    def __init__(self, input_path, output_path):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.data = None
+        self.error = None
+        self.cached = None
+        self.elapsed = 0.
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _rectify(input_path, data, roads, validate, memoize, threads):
+    if data is None:
+        return rectify_image(input_path)
+    return rectify_bytes(data, roads=roads, validate=validate, memoize=memoize, threads=threads)
+
+
+def run_async_batch(pending, report, workers=None, cache=None, roads=False, validate=False, memoize=False, threads=None,
+                    queue_depth=DEFAULT_QUEUE_DEPTH, stats=None):
+    """
+    Rectifies (input_path, output_path) pairs in a pipeline overlapping file I/O and rectification
+
+    A reader prefetches inputs in a thread, `workers` processes rectify them, a writer writes outputs in a thread
+    Stages are connected by queues of `queue_depth` files: a full queue blocks the stage feeding it,
+    so at most about 2 * queue_depth + workers files are in memory
+    `cache` is looked up and filled in the rectify stage, in a thread of its own so that its file I/O does not block
+    the event loop and its counters are not updated concurrently
+    `report` is called with each FileResult when written
+    If a PipelineStats is given, it is filled with the utilization of each stage
+    Raise ValueError if queue_depth is not positive, asyncio queues being unbounded then
+    """
+    if queue_depth < 1:
+        raise ValueError(f'queue depth must be positive, got {queue_depth}')
+    if stats is None:
+        stats = PipelineStats()
+    workers = workers or 1
+    executor_class = ThreadPoolExecutor if workers == 1 else ProcessPoolExecutor
+    with executor_class(max_workers=workers) as rectify_executor, ThreadPoolExecutor(max_workers=2) as io_executor, \
+            ThreadPoolExecutor(max_workers=1) as cache_executor:
+        start = time.perf_counter()
+        asyncio.run(_pipeline(pending, report, rectify_executor, io_executor, cache_executor, workers, cache, roads,
+                              validate, memoize, threads, queue_depth, stats))
+        stats.wall_time = time.perf_counter() - start
+    return stats
+
+
+async def _pipeline(pending, report, rectify_executor, io_executor, cache_executor, workers, cache, roads, validate,
+                    memoize, threads, queue_depth, stats):
+    loop = asyncio.get_running_loop()
+    to_rectify = asyncio.Queue(queue_depth)
+    to_write = asyncio.Queue(queue_depth)
+
+    read_stats = stats.stages['read'] = StageUtilization('read')
+    rectify_stats = stats.stages['rectify'] = StageUtilization('rectify', workers)
+    write_stats = stats.stages['write'] = StageUtilization('write')
+
+    async def put(queue, item, stage):
+        start = time.perf_counter()
+        await queue.put(item)
+        stage.blocked += time.perf_counter() - start
+
+    async def get(queue, stage):
+        start = time.perf_counter()
+        item = await queue.get()
+        stage.starved += time.perf_counter() - start
+        return item
+
+    async def read():
+        for input_path, output_path in pending:
+            item = _Item(input_path, output_path)
+            start = time.perf_counter()
+            if not is_image_path(input_path):
+                try:
+                    item.data = await loop.run_in_executor(io_executor, _read, input_path)
+                except OSError as e:
+                    item.error = format_error(e)
+            item.elapsed += time.perf_counter() - start
+            read_stats.busy += time.perf_counter() - start
+            read_stats.items += 1
+            await put(to_rectify, item, read_stats)
+        for _ in range(workers):
+            await put(to_rectify, None, read_stats)
+
+    async def rectify():
+        while True:
+            item = await get(to_rectify, rectify_stats)
+            if item is None:
+                break
+            start = time.perf_counter()
+            if item.error is None:
+                use_cache = cache is not None and item.data is not None  # images are not cached
+                try:
+                    result = None
+                    if use_cache:
+                        result = await loop.run_in_executor(cache_executor, cache.get, item.data)
+                        item.cached = result is not None
+                    if result is None:
+                        result = await loop.run_in_executor(
+                            rectify_executor, _rectify, item.input_path, item.data, roads, validate, memoize, threads
+                        )
+                        if use_cache:
+                            await loop.run_in_executor(cache_executor, cache.put, item.data, result)
+                    item.data = result
+                except Exception as e:
+                    item.error = format_error(e)
+            item.elapsed += time.perf_counter() - start
+            rectify_stats.busy += time.perf_counter() - start
+            rectify_stats.items += 1
+            await put(to_write, item, rectify_stats)
+
+    async def write():
+        while True:
+            item = await get(to_write, write_stats)
+            if item is None:
+                break
+            start = time.perf_counter()
+            if item.error is None:
+                try:
+                    await loop.run_in_executor(io_executor, _write, item.output_path, item.data)
+                except OSError as e:
+                    item.error = format_error(e)
+            item.elapsed += time.perf_counter() - start
+            write_stats.busy += time.perf_counter() - start
+            write_stats.items += 1
+
+            if item.error is None:
+                report(FileResult(item.input_path, item.output_path, 'done', item.elapsed, None, item.cached))
+            else:
+                report(FileResult(item.input_path, item.output_path, 'failed', item.elapsed, item.error, None))
+
+    writer = asyncio.ensure_future(write())
+    await asyncio.gather(read(), *(rectify() for _ in range(workers)))
+    await to_write.put(None)
+    await writer
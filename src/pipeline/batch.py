@@ -0,0 +1,188 @@
+import glob
+import os
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.nh_data.codec import MAP_SIZE, write_map
+from src.nh_data.terrain import map_file
+from src.pipeline.rectify import rectify_bytes, rectify_map, rectify_image_records, rectified_path, is_rectified_path, \
+    is_image_path
+from src.utils.profiling import profile_stage
+
+
+# status is one of 'done', 'skipped' or 'failed', cached tells if the output came from the ResultCache
+FileResult = namedtuple('FileResult', ['input_path', 'output_path', 'status', 'elapsed', 'error', 'cached'])
+
+DEFAULT_QUEUE_DEPTH = 4  # files buffered between the stages of run_async_batch
+
+
+def format_error(e):
+    """
+    Error message of a failed file
+    """
+    return f'{type(e).__name__}: {e}'
+
+
+def collect_inputs(patterns):
+    """
+    Expands directories and glob patterns to a sorted list of input files
+    Directories give their .nht files only, images must be given by name or glob pattern
+    Files already being rectification outputs are left out
+
+    Raise ValueError if several inputs would be rectified to the same output, like map.nht and map.png
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '*.nht'))
+        elif glob.has_magic(pattern):
+            matches = glob.glob(pattern, recursive=True)
+        else:
+            matches = [pattern]  # kept even if missing, to be reported as a failure
+        paths.update(os.path.normpath(path) for path in matches if not is_rectified_path(path))
+
+    inputs_by_output = {}
+    for path in sorted(paths):
+        inputs_by_output.setdefault(os.path.normcase(rectified_path(path)), []).append(path)
+    conflicts = [inputs for inputs in inputs_by_output.values() if len(inputs) > 1]
+    if conflicts:
+        raise ValueError('inputs with the same output: ' + '; '.join(' and '.join(inputs) for inputs in conflicts))
+    return sorted(paths)
+
+
+def is_up_to_date(input_path, output_path):
+    """
+    Whether output was written after the last modification of input
+    """
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+
+def rectify_file(input_path, output_path=None, cache=None, roads=False, validate=False, memoize=False,
+                 threads=None):
+    """
+    Rectifies a single file, returns its FileResult
+    Images (see BasicMap.save_img) are rectified directly, without cache nor roads
+    """
+    if output_path is None:
+        output_path = rectified_path(input_path)
+
+    start = time.perf_counter()
+    hits = cache.hits if cache is not None else 0
+    try:
+        # outputs not going to the cache are streamed to the file, see NH_Terrain_Map.write_all
+        if is_image_path(input_path):
+            cache = None
+            records = rectify_image_records(input_path)
+            with profile_stage('write'), open(output_path, 'wb') as f:
+                write_map(records, f)
+        else:
+            with ExitStack() as mapped:  # the input is unmapped before writing, which may replace it
+                with profile_stage('read'):
+                    data = mapped.enter_context(map_file(input_path))
+                if cache is None:
+                    rectified_map = rectify_map(data, roads, validate, memoize, threads)
+                else:
+                    rectified_data = rectify_bytes(data, cache, roads, validate, memoize, threads)
+            with profile_stage('write'), open(output_path, 'wb') as f:
+                if cache is None:
+                    rectified_map.write_all(f)
+                else:
+                    f.write(rectified_data)
+    except Exception as e:
+        return FileResult(input_path, output_path, 'failed', time.perf_counter() - start, format_error(e), None)
+    cached = cache.hits > hits if cache is not None else None
+    return FileResult(input_path, output_path, 'done', time.perf_counter() - start, None, cached)
+
+
+def run_batch(input_paths, workers=None, force=False, on_result=None, cache=None, roads=False, validate=False,
+              memoize=False, threads=None, shared_memory=False, async_io=False, queue_depth=DEFAULT_QUEUE_DEPTH,
+              pipeline_stats=None):
+    """
+    Rectifies all files into their rectified_path, in a pool of `workers` processes (cpu count if None)
+
+    Files whose output is up to date are skipped unless `force` is set
+    Outputs are looked up in and added to `cache` if a ResultCache is given
+    Roads are kept and rectified if `roads` is set, outputs are checked if `validate` is set,
+    acres are memoized in each process if `memoize` is set, each map is matched in `threads` threads, see rectify_bytes
+    A failing file does not stop the batch, it is reported in its FileResult
+    `on_result` is called with each FileResult as soon as it is available
+    With `shared_memory`, files are handed over to the workers in shared memory blocks, see run_shared_batch
+    With `async_io`, file I/O overlaps rectification, see run_async_batch for `queue_depth` and `pipeline_stats`
+    Raise ValueError if both `shared_memory` and `async_io` are set, the async pipeline does not use shared memory
+    """
+    if shared_memory and async_io:
+        raise ValueError('shared memory and async I/O can not be combined')
+    results = []
+
+    def report(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    pending = []
+    for input_path in input_paths:
+        output_path = rectified_path(input_path)
+        if not force and is_up_to_date(input_path, output_path):
+            report(FileResult(input_path, output_path, 'skipped', 0., None, None))
+        else:
+            pending.append((input_path, output_path))
+
+    if async_io:
+        from src.pipeline.async_batch import run_async_batch  # imports this module
+        run_async_batch(pending, report, workers or os.cpu_count(), cache, roads, validate, memoize, threads,
+                        queue_depth, pipeline_stats)
+    elif workers == 1 or len(pending) <= 1:
+        for input_path, output_path in pending:
+            report(rectify_file(input_path, output_path, cache, roads, validate, memoize, threads))
+    elif shared_memory:
+        from src.pipeline.shared_batch import run_shared_batch  # imports this module
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            run_shared_batch(pending, executor, report, cache, roads, validate, memoize, threads)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(rectify_file, *paths, cache, roads, validate, memoize, threads): paths
+                for paths in pending
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    if cache is not None and result.cached is not None:
+                        # workers count their lookups in their own copy of the cache
+                        cache.record(result.cached, MAP_SIZE)
+                    report(result)
+                except Exception as e:  # worker process died
+                    input_path, output_path = futures[future]
+                    report(FileResult(input_path, output_path, 'failed', 0., format_error(e), None))
+
+    return results
+
+
+def format_result(result):
+    if result.status == 'done':
+        cached = ' (cached)' if result.cached else ''
+        return f'{result.input_path}: {result.elapsed * 1000:.1f} ms{cached} -> {result.output_path}'
+    if result.status == 'skipped':
+        return f'{result.input_path}: skipped, up to date'
+    return f'{result.input_path}: FAILED {result.error}'
+
+
+def format_summary(results, cache=None):
+    """
+    One line summary of a batch, with the lookups statistics of its ResultCache if given
+    """
+    counts = {status: sum(r.status == status for r in results) for status in ('done', 'skipped', 'failed')}
+    total = sum(r.elapsed for r in results)
+    summary = (f"{counts['done']} rectified, {counts['skipped']} skipped, {counts['failed']} failed "
+               f"({total:.2f} s of work)")
+
+    if cache is not None:
+        stats = cache.stats()
+        summary += (f", cache: {stats['hits']} hits, {stats['misses']} misses, "
+                    f"{stats['bytes_saved'] / 2**20:.1f} MiB saved")
+    return summary
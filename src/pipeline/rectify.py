@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+
+from src.enums.tile_types import GROUND_LUT, TERRAIN_CODES, ROAD_CODES
+from src.nh_data.codec import decode_map, encode_map
+from src.nh_data.acre_memo import get_acre_memo
+from src.nh_data.terrain import NH_Terrain_Map
+from src.nh_data.converter import convert_nhmap_to_basicmap, convert_basicmap_to_rectified_nhmap, rectify_stack
+from src.nh_data.roads import rectify_roads
+from src.nh_data.validator import validate_rectified, InconsistentTilesError
+from src.internal_data.terrain import BasicTileType, check_map_rgb, image_to_rgb, rgb_to_basic
+from src.utils.profiling import profile_stage
+
+
+RECTIFIED_SUFFIX = '_rectified'
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.gif', '.tif', '.tiff')  # lossless formats, for maps edited as images
+
+
+def rectify_bytes(data, cache=None, roads=False, validate=False, memoize=False, threads=None, out=None):
+    """
+    Rectifies a NHSE dump-all file content, returning the content to import back
+    `data` can be any buffer, it is read in place
+    If `out` is given, a writable buffer of MAP_SIZE bytes, the content is encoded into it and `out` is returned
+
+    Roads are dropped, unless `roads` is set: they are then kept and their shapes rectified
+    If a ResultCache is given, it is looked up first and filled on misses
+    With `validate`, raise InconsistentTilesError if the result disagrees with the patterns, see validate_rectified
+    With `memoize`, acres already rectified in the process are reused, see AcreMemo
+    With `threads` > 1, the map is matched by bands of rows in as many threads, for latency on a single map
+    """
+    if cache is not None:
+        with profile_stage('cache_get'):
+            result = cache.get(data)
+        if result is None:
+            result = rectify_bytes(data, roads=roads, validate=validate, memoize=memoize, threads=threads, out=out)
+            with profile_stage('cache_put'):
+                cache.put(data, result)
+        elif out is not None:
+            out[:] = result
+            result = out
+        return result
+
+    rectified_nh_map = rectify_map(data, roads, validate, memoize, threads)
+    with profile_stage('dump_all'):
+        if out is not None:
+            return rectified_nh_map.dump_all_into(out)
+        return rectified_nh_map.dump_all()
+
+
+def rectify_map(data, roads=False, validate=False, memoize=False, threads=None):
+    """
+    rectify_bytes returning the rectified NH_Terrain_Map, to be encoded with dump_all, dump_all_into or write_all
+    """
+    with profile_stage('load'):
+        imported_map = NH_Terrain_Map.from_buffer(data)
+
+    with profile_stage('convert_nhmap_to_basicmap'):
+        converted_map = convert_nhmap_to_basicmap(imported_map)
+
+    with profile_stage('convert_basicmap_to_rectified_nhmap'):
+        if memoize:
+            rectified_nh_map = convert_basicmap_to_rectified_nhmap(converted_map, acre_memo=get_acre_memo())
+        elif threads is not None and threads > 1:
+            rectified_nh_map = convert_basicmap_to_rectified_nhmap(converted_map, 'threaded', workers=threads)
+        else:
+            rectified_nh_map = convert_basicmap_to_rectified_nhmap(converted_map)
+
+    if roads:
+        with profile_stage('rectify_roads'):
+            rectified_nh_map.road_code[...] = imported_map.road_code
+            rectified_nh_map.road_variation[...] = imported_map.road_variation
+            rectify_roads(rectified_nh_map)
+
+    if validate:
+        with profile_stage('validate'):
+            errors = validate_rectified(rectified_nh_map, imported_map)
+        if errors:
+            raise InconsistentTilesError(errors)
+
+    return rectified_nh_map
+
+
+def rectify_many(buffers):
+    """
+    rectify_bytes of several NHSE dump-all contents, rectified together in a single pass
+    Raise UnknownCodeError listing the (island, y, x) positions of invalid codes
+    """
+    with profile_stage('load'):
+        records = np.stack([decode_map(data) for data in buffers])
+        TERRAIN_CODES.decode(records['terrain_type'])
+        ROAD_CODES.decode(records['road_type'])
+
+    with profile_stage('rectify_stack'):
+        # same conversions as convert_nhmap_to_basicmap
+        rectified_records = rectify_stack(GROUND_LUT[records['terrain_type']], records['elevation'].astype(np.uint8))
+
+    with profile_stage('dump_all'):
+        return [encode_map(island_records) for island_records in rectified_records]
+
+
+def rectify_image(img):
+    """
+    Rectifies a map edited as an image, see BasicMap.save_img, returning the NHSE import-all content
+    `img` is a PIL image or an image file path
+    Raise ValueError if the image is not the size of a map
+    """
+    records = rectify_image_records(img)
+    with profile_stage('dump_all'):
+        return encode_map(records)
+
+
+def rectify_image_records(img):
+    """
+    rectify_image returning the (HEIGHT, WIDTH) array of rectified tiles records, to be encoded with write_map
+    """
+    with profile_stage('load'):
+        rgb = image_to_rgb(img)
+        check_map_rgb(rgb)
+        type, elevation = rgb_to_basic(rgb)
+
+    with profile_stage('rectify_stack'):
+        records = rectify_stack((type == BasicTileType.GROUND.value)[np.newaxis], elevation[np.newaxis])
+    return records[0]
+
+
+def rectified_path(path):
+    """
+    Output path of a rectified file, next to its input: terrainAcres.nht -> terrainAcres_rectified.nht
+    Images are rectified to .nht files: map.png -> map_rectified.nht
+    """
+    root, ext = os.path.splitext(path)
+    if is_image_path(path):
+        ext = '.nht'
+    return f'{root}{RECTIFIED_SUFFIX}{ext}'
+
+
+def is_image_path(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def is_rectified_path(path):
+    return os.path.splitext(path)[0].endswith(RECTIFIED_SUFFIX)
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import tempfile
+
+from src.enums.tile_types import dict_patches
+from src.nh_data.pattern_table import patches_digest
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ResultCache(object):
+    """
+    On-disk cache of rectified outputs, keyed by a hash of the input content and of the pattern table
+
+    Outputs of different rectification options must use different `namespace`
+
+    Least recently used entries are evicted when the cache grows over `max_bytes`
+    Counters: hits, misses and bytes_saved (size of the outputs served from the cache)
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, namespace=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._table_digest = f'{namespace}:{patches_digest(dict_patches)}'.encode()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data):
+        h = hashlib.sha256(self._table_digest)
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.nht')
+
+    def get(self, data):
+        """
+        Cached output for input `data`, None on a miss
+        """
+        path = self._path(self.key(data))
+        try:
+            with open(path, 'rb') as f:
+                result = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            self.record(False)
+            return None
+        self.record(True, len(result))
+        return result
+
+    def record(self, hit, size=0):
+        """
+        Counts a lookup, of a `size` bytes output on a hit
+        Also used to add up the lookups made by copies of the cache in worker processes
+        """
+        if hit:
+            self.hits += 1
+            self.bytes_saved += size
+        else:
+            self.misses += 1
+
+    def put(self, data, result):
+        """
+        Stores `result` as the output of input `data`, then evicts old entries if needed
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(result)
+            os.replace(tmp_path, self._path(self.key(data)))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.nht'):
+                try:
+                    stat = entry.stat()
+                except OSError:  # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bytes_saved': self.bytes_saved}
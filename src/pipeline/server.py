@@ -0,0 +1,220 @@
+import json
+import os
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from src.nh_data.codec import MAP_SIZE
+from src.nh_data.pattern_table import get_pattern_table
+from src.nh_data.roads import get_road_table
+from src.pipeline.rectify import rectify_bytes
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+def _warm_up():
+    """
+    Loads the pattern tables of a worker process before its first request
+    """
+    get_pattern_table()
+    get_road_table()
+
+
+class ServiceStats(object):
+    """
+    Throughput counters of a RectifyService, safe to update from several threads
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.failed = 0
+        self.active = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.busy_time = 0.  # summed rectification time of the requests, in seconds
+        self._lock = threading.Lock()
+
+    def begin(self, size):
+        with self._lock:
+            self.active += 1
+            self.bytes_in += size
+
+    def end(self, elapsed, size=None):
+        with self._lock:
+            self.active -= 1
+            self.requests += 1
+            self.busy_time += elapsed
+            if size is None:
+                self.failed += 1
+            else:
+                self.bytes_out += size
+
+    def to_dict(self):
+        with self._lock:
+            uptime = time.time() - self.started
+            done = self.requests - self.failed
+            return {
+                'uptime': uptime,
+                'requests': self.requests,
+                'failed': self.failed,
+                'active': self.active,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'requests_per_second': done / uptime if uptime else 0.,
+                'mean_latency_ms': self.busy_time / self.requests * 1000 if self.requests else 0.,
+            }
+
+
+class RectifyService(object):
+    """
+    Rectifies NHSE dump-all contents in a pool of `workers` processes (cpu count if None)
+    whose pattern tables are loaded once, when the service starts
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = ServiceStats()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+        # start the workers now rather than on the first request
+        for future in [self._executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def rectify(self, data, roads=False):
+        """
+        Rectified content of `data`, see rectify_bytes
+        """
+        self.stats.begin(len(data))
+        start = time.perf_counter()
+        result = None
+        try:
+            result = self._executor.submit(rectify_bytes, data, None, roads).result()
+            return result
+        finally:
+            self.stats.end(time.perf_counter() - start, None if result is None else len(result))
+
+    def health(self):
+        return dict(status='ok', workers=self.workers, **self.stats.to_dict())
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class RectifyHandler(BaseHTTPRequestHandler):
+    """
+    POST /rectify[?roads=1] with a .nht content as body, answers the rectified content
+    GET /health answers the service counters as JSON
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/health':
+            self._send(404, b'not found\n')
+            return
+        body = json.dumps(self.server.service.health()).encode() + b'\n'
+        self._send(200, body, 'application/json')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/rectify':
+            self._send(404, b'not found\n')
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length != MAP_SIZE:
+            self.close_connection = True
+            self._send(400, f'expected a {MAP_SIZE} bytes body, got {length}\n'.encode())
+            return
+        data = self.rfile.read(length)
+
+        roads = parse_qs(url.query).get('roads', ['0'])[-1] not in ('0', 'false', '')
+        try:
+            result = self.server.service.rectify(data, roads)
+        except ValueError as e:  # invalid codes
+            self._send(400, f'{type(e).__name__}: {e}\n'.encode())
+            return
+        except Exception as e:
+            self._send(500, f'{type(e).__name__}: {e}\n'.encode())
+            return
+        self._send(200, result, 'application/octet-stream')
+
+    def _send(self, status, body, content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else self.server.server_address
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+if hasattr(socketserver, 'UnixStreamServer'):  # not on Windows
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def _clear_unix_socket(path):
+    """
+    Removes the socket left at `path` by a previous server
+    Raise NotImplementedError without unix sockets support, FileExistsError if `path` is not a socket
+    """
+    if not hasattr(socketserver, 'UnixStreamServer'):
+        raise NotImplementedError('unix sockets are not supported on this platform')
+    if _is_socket(path):
+        os.remove(path)
+    elif os.path.lexists(path):
+        raise FileExistsError(f'{path} already exists and is not a socket')
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, verbose=False):
+    """
+    HTTP server of `service`, listening on `unix_socket` if given, on localhost `port` otherwise
+    Each connection is handled in its own thread
+    A socket already at `unix_socket` is replaced, any other file is an error, see _clear_unix_socket
+    """
+    if unix_socket is not None:
+        _clear_unix_socket(unix_socket)
+        server = UnixHTTPServer(unix_socket, RectifyHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RectifyHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def serve(workers=None, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, verbose=False):
+    """
+    Runs a rectification server until interrupted
+    """
+    if unix_socket is not None:
+        _clear_unix_socket(unix_socket)  # before starting the workers
+    service = RectifyService(workers)
+    server = make_server(service, host, port, unix_socket, verbose)
+    where = unix_socket if unix_socket is not None else f'http://{host}:{port}'
+    print(f'rectifying on {where} with {service.workers} workers, Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if unix_socket is not None and _is_socket(unix_socket):
+            os.remove(unix_socket)
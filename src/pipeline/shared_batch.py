@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+from concurrent.futures import as_completed
+from multiprocessing import shared_memory
+
+from src.nh_data.codec import MAP_SIZE
+from src.pipeline.batch import FileResult, rectify_file, format_error
+from src.pipeline.rectify import rectify_bytes, is_image_path
+
+
+DEFAULT_CHUNK_SIZE = 64  # files per shared memory block, 9.6 MB for inputs and as much for outputs
+
+
+def _attach(name):
+    """
+    Opens a shared memory block created by the parent process
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    # before 3.13 attaching registers the block to the resource tracker, which would then unlink it or warn about it
+    # on worker exit, while the parent owns it
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def rectify_slot(input_name, output_name, slot, roads=False, validate=False, memoize=False, threads=None):
+    """
+    Rectifies the input at `slot` of shared block `input_name` into the same slot of block `output_name`
+    Runs in worker processes, only block names and the slot are sent to them
+
+    Returns (elapsed, error), error being None on success
+    """
+    start = time.perf_counter()
+    inputs = _attach(input_name)
+    outputs = _attach(output_name)
+    try:
+        window = slice(slot * MAP_SIZE, (slot + 1) * MAP_SIZE)
+        data, out = inputs.buf[window], outputs.buf[window]
+        try:
+            rectify_bytes(data, roads=roads, validate=validate, memoize=memoize, threads=threads, out=out)
+        finally:
+            data.release()
+            out.release()
+    except Exception as e:
+        return time.perf_counter() - start, format_error(e)
+    finally:
+        inputs.close()
+        outputs.close()
+    return time.perf_counter() - start, None
+
+
+def _read_into(path, buffer):
+    """
+    Reads a .nht file into `buffer`
+    Raise ValueError if the file is not MAP_SIZE bytes long, like decode_map
+    """
+    size = os.path.getsize(path)
+    if size != MAP_SIZE:
+        raise ValueError(f'expected {MAP_SIZE} bytes, got {size}')
+    with open(path, 'rb') as f:
+        f.readinto(buffer)
+
+
+def run_shared_batch(pending, executor, report, cache=None, roads=False, validate=False, memoize=False,
+                     threads=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Rectifies (input_path, output_path) pairs in `executor`, handing inputs and outputs over in shared memory
+
+    Files are processed by chunks of `chunk_size`: the parent reads them into a shared input block,
+    workers rectify each slot into a shared output block, then the parent writes the outputs
+    Peak memory is bounded by the two blocks whatever the batch size
+    Images are not handed over, they are rectified by rectify_file in the workers
+    `cache` is looked up and filled by the parent, `report` is called with each FileResult
+    """
+    images = [paths for paths in pending if is_image_path(paths[0])]
+    maps = [paths for paths in pending if not is_image_path(paths[0])]
+
+    image_futures = {
+        executor.submit(rectify_file, *paths, None, roads, validate, memoize, threads): paths for paths in images
+    }
+
+    if maps:
+        slots = min(chunk_size, len(maps))
+        inputs = shared_memory.SharedMemory(create=True, size=slots * MAP_SIZE)
+        outputs = shared_memory.SharedMemory(create=True, size=slots * MAP_SIZE)
+        try:
+            for start in range(0, len(maps), slots):
+                _run_chunk(maps[start:start + slots], inputs, outputs, executor, report, cache, roads, validate,
+                           memoize, threads)
+        finally:
+            for block in (inputs, outputs):
+                block.close()
+                block.unlink()
+
+    for future in as_completed(image_futures):
+        try:
+            report(future.result())
+        except Exception as e:  # worker process died
+            input_path, output_path = image_futures[future]
+            report(FileResult(input_path, output_path, 'failed', 0., format_error(e), None))
+
+
+def _run_chunk(chunk, inputs, outputs, executor, report, cache, roads, validate, memoize, threads):
+    futures = {}
+    for slot, (input_path, output_path) in enumerate(chunk):
+        window = slice(slot * MAP_SIZE, (slot + 1) * MAP_SIZE)
+        start = time.perf_counter()
+        try:
+            _read_into(input_path, inputs.buf[window])
+        except (OSError, ValueError) as e:
+            report(FileResult(input_path, output_path, 'failed', time.perf_counter() - start, format_error(e), None))
+            continue
+
+        if cache is not None:
+            result = cache.get(inputs.buf[window])
+            if result is not None:
+                report(_write_output(input_path, output_path, result, time.perf_counter() - start, True))
+                continue
+
+        future = executor.submit(rectify_slot, inputs.name, outputs.name, slot, roads, validate, memoize, threads)
+        futures[future] = (slot, input_path, output_path)
+
+    for future in as_completed(futures):
+        slot, input_path, output_path = futures[future]
+        window = slice(slot * MAP_SIZE, (slot + 1) * MAP_SIZE)
+        try:
+            elapsed, error = future.result()
+        except Exception as e:  # worker process died
+            elapsed, error = 0., format_error(e)
+        if error is not None:
+            report(FileResult(input_path, output_path, 'failed', elapsed, error, None))
+            continue
+
+        cached = None
+        if cache is not None:
+            cache.put(inputs.buf[window], outputs.buf[window])
+            cached = False
+        report(_write_output(input_path, output_path, outputs.buf[window], elapsed, cached))
+
+
+def _write_output(input_path, output_path, data, elapsed, cached):
+    start = time.perf_counter()
+    try:
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    except OSError as e:
+        return FileResult(input_path, output_path, 'failed', elapsed, format_error(e), None)
+    return FileResult(input_path, output_path, 'done', elapsed + time.perf_counter() - start, None, cached)
@@ -0,0 +1,40 @@
+class TileGrid(object):
+    """
+    Read-only 2D accessor keeping the `grid[y][x]` syntax on top of array-backed maps
+    Tiles are created on access by `factory(y, x)`, nothing is stored per tile
+    """
+    def __init__(self, factory, height, width):
+        self._factory = factory
+        self.height = height
+        self.width = width
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, y):
+        if not -self.height <= y < self.height:
+            raise IndexError(y)
+        return _TileRow(self, y % self.height)
+
+    def __iter__(self):
+        for y in range(self.height):
+            yield _TileRow(self, y)
+
+
+class _TileRow(object):
+    def __init__(self, grid, y):
+        self._grid = grid
+        self._y = y
+
+    def __len__(self):
+        return self._grid.width
+
+    def __getitem__(self, x):
+        width = self._grid.width
+        if not -width <= x < width:
+            raise IndexError(x)
+        return self._grid._factory(self._y, x % width)
+
+    def __iter__(self):
+        for x in range(self._grid.width):
+            yield self._grid._factory(self._y, x)
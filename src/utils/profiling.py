@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.
+        self.allocated = 0  # largest allocation peak over calls, in bytes
+
+    def to_dict(self):
+        return {'calls': self.calls, 'wall_time': self.wall_time, 'allocated': self.allocated}
+
+
+class Profiler(object):
+    """
+    Records wall time, call count and allocation peak of named stages, and named counters
+
+    Allocations are only measured with `trace_allocations`, which starts tracemalloc and slows everything down
+    `callback(name, wall_time, allocated)` is called at the end of each stage
+    Counters sum the values given to count, like the tiles won by each pattern family
+    """
+    def __init__(self, trace_allocations=False, callback=None):
+        self.trace_allocations = trace_allocations
+        self.callback = callback
+        self.stats = {}
+        self.counters = {}
+        self.events = []
+        self.counter_events = []
+        self._origin = time.perf_counter()
+        self._peaks = []  # [start, peak] of the stages being measured, innermost last
+
+    @contextmanager
+    def stage(self, name):
+        tracing = self.trace_allocations and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+            if hasattr(tracemalloc, 'reset_peak'):  # python >= 3.9, peaks are counted from the tracing start otherwise
+                tracemalloc.reset_peak()
+            self._peaks.append([current, current])
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start
+
+            allocated = 0
+            if tracing:
+                stage_start, stage_peak = self._peaks.pop()
+                stage_peak = max(stage_peak, tracemalloc.get_traced_memory()[1])
+                allocated = stage_peak - stage_start
+                if self._peaks:
+                    self._peaks[-1][1] = max(self._peaks[-1][1], stage_peak)
+
+            self._record(name, start, wall_time, allocated)
+
+    def _record(self, name, start, wall_time, allocated):
+        stats = self.stats.setdefault(name, StageStats())
+        stats.calls += 1
+        stats.wall_time += wall_time
+        stats.allocated = max(stats.allocated, allocated)
+
+        self.events.append((name, start - self._origin, wall_time, allocated, threading.get_ident()))
+
+        if self.callback is not None:
+            self.callback(name, wall_time, allocated)
+
+    def count(self, name, values):
+        """
+        Adds `values`, a dict of numbers, to counter `name`
+        """
+        counter = self.counters.setdefault(name, {})
+        for key, value in values.items():
+            counter[key] = counter.get(key, 0) + value
+        self.counter_events.append((name, time.perf_counter() - self._origin, dict(counter)))
+
+    def to_dict(self):
+        data = {name: stats.to_dict() for name, stats in self.stats.items()}
+        data.update((name, dict(counter)) for name, counter in self.counters.items())
+        return data
+
+    def to_chrome_trace(self):
+        """
+        Events in Chrome trace format, to open in chrome://tracing or Perfetto
+        """
+        pid = os.getpid()
+        return {
+            'traceEvents': [
+                {
+                    'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                    'ts': start * 1e6, 'dur': wall_time * 1e6,
+                    'args': {'allocated': allocated},
+                }
+                for name, start, wall_time, allocated, tid in self.events
+            ] + [
+                {'name': name, 'ph': 'C', 'pid': pid, 'ts': start * 1e6, 'args': values}
+                for name, start, values in self.counter_events
+            ],
+            'displayTimeUnit': 'ms',
+        }
+
+    def save(self, path, format='json'):
+        """
+        Saves stages statistics and counters ('json') or events ('chrome')
+        """
+        data = self.to_chrome_trace() if format == 'chrome' else self.to_dict()
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+
+_active_profiler = None
+
+
+@contextmanager
+def profiling(profiler):
+    """
+    Makes `profiler` record the profile_stage of the code run in the block
+    """
+    global _active_profiler
+    previous, _active_profiler = _active_profiler, profiler
+    started_tracing = profiler.trace_allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield profiler
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _active_profiler = previous
+
+
+@contextmanager
+def _no_stage():
+    yield
+
+
+def profile_stage(name):
+    """
+    Context manager recording a stage in the active profiler, doing nothing when there is none
+    """
+    if _active_profiler is None:
+        return _no_stage()
+    return _active_profiler.stage(name)
+
+
+def profile_count(name, values):
+    """
+    Adds `values` to a counter of the active profiler, see Profiler.count, doing nothing when there is none
+    """
+    if _active_profiler is not None:
+        _active_profiler.count(name, values)
+
+
+def is_profiling():
+    """
+    Whether a profiler is active, to skip computing what only it would record
+    """
+    return _active_profiler is not None
@@ -0,0 +1,27 @@
+import pytest
+
+from benchmarks.synthetic import rivers_island
+from src.nh_data.terrain import NH_Terrain_Map
+from src.pipeline.rectify import rectify_bytes, rectify_many
+from src.utils.profiling import Profiler, profiling
+
+
+INTERIOR_TILES = (NH_Terrain_Map.HEIGHT - 2) * (NH_Terrain_Map.WIDTH - 2)
+
+
+@pytest.mark.parametrize('options', [{}, {'memoize': True}, {'threads': 3}])
+def test_winners_by_family(options):
+    profiler = Profiler()
+    with profiling(profiler):
+        rectify_bytes(rivers_island(0), **options)
+
+    winners = profiler.to_dict()['winners']
+    assert sum(winners.values()) == INTERIOR_TILES
+    assert winners['Cliff'] > 0 and winners['River'] > 0 and winners['Fall'] > 0
+
+
+def test_winners_of_stacked_islands():
+    profiler = Profiler()
+    with profiling(profiler):
+        rectify_many([rivers_island(0), rivers_island(1)])
+    assert sum(profiler.to_dict()['winners'].values()) == 2 * INTERIOR_TILES
@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+from benchmarks.synthetic import ISLANDS
+from src.internal_data.terrain import BasicMap, BasicTileType
+from src.nh_data.acre_memo import AcreMemo
+from src.nh_data.converter import (
+    convert_nhmap_to_basicmap, convert_basicmap_to_rectified_nhmap, convert_basicmaps_to_rectified_nhmaps,
+    rectify_dirty_region
+)
+from src.nh_data.terrain import NH_Terrain_Map
+from src.pipeline.rectify import rectify_many
+
+
+pytest.importorskip('scipy')  # for the correlate rectifier
+
+
+# outputs of the original correlate rectifier, the reference of all other paths
+@pytest.fixture(scope='module', params=list(ISLANDS))
+def island(request):
+    data = ISLANDS[request.param](0)
+    basic_map = convert_nhmap_to_basicmap(NH_Terrain_Map.from_buffer(data))
+    return data, basic_map, convert_basicmap_to_rectified_nhmap(basic_map, 'correlate').dump_all()
+
+
+def copy_basic_map(basic_map):
+    copy = BasicMap()
+    copy.type[...] = basic_map.type
+    copy.elevation[...] = basic_map.elevation
+    return copy
+
+
+def test_lookup(island):
+    _, basic_map, expected = island
+    assert convert_basicmap_to_rectified_nhmap(basic_map).dump_all() == expected
+
+
+@pytest.mark.parametrize('workers', [2, 5])
+def test_threaded(island, workers):
+    _, basic_map, expected = island
+    assert convert_basicmap_to_rectified_nhmap(basic_map, 'threaded', workers=workers).dump_all() == expected
+
+
+def test_memoized(island):
+    _, basic_map, expected = island
+    acre_memo = AcreMemo()
+    for _ in range(2):  # acres matched, then reused
+        assert convert_basicmap_to_rectified_nhmap(basic_map, acre_memo=acre_memo).dump_all() == expected
+    assert acre_memo.stats()['hits'] > 0
+
+
+def test_stacked(island):
+    data, basic_map, expected = island
+    assert convert_basicmaps_to_rectified_nhmaps([basic_map, basic_map], encode=True) == [expected, expected]
+    assert rectify_many([data]) == [expected]
+
+
+def test_incremental(island):
+    _, basic_map, _ = island
+    edited = copy_basic_map(basic_map)
+    edited.elevation[30:50, 40:70] += 1
+    edited.type[60:64, 10:90] = BasicTileType.WATER.value
+
+    nh_map = convert_basicmap_to_rectified_nhmap(basic_map)
+    rectify_dirty_region(nh_map, edited, previous_basic_map=basic_map)
+    assert nh_map.dump_all() == convert_basicmap_to_rectified_nhmap(edited, 'correlate').dump_all()
+
+
+def test_round_trip(island):
+    data, _, expected = island
+    for content in (data, expected):  # painted types only, then all rectified types and rotations
+        nh_map = NH_Terrain_Map()
+        nh_map.load_all(content)
+        assert nh_map.dump_all() == content
+        assert NH_Terrain_Map.from_buffer(content).dump_all() == content
+
+        streamed = io.BytesIO()
+        nh_map.write_all(streamed)
+        assert streamed.getvalue() == content
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import ISLANDS
+from src.enums.tile_types import GROUND_LUT
+from src.nh_data.codec import decode_map
+from src.nh_data.converter import (
+    convert_nhmap_to_basicmap, convert_basicmap_to_rectified_nhmap, convert_basicmaps_to_rectified_nhmaps
+)
+from src.nh_data.matcher import match_patterns
+from src.nh_data.terrain import NH_Terrain_Map
+from src.pipeline.rectify import rectify_bytes, rectify_many, rectify_image
+
+
+ISLAND_BUFFERS = {f'{name}{seed}': generate(seed) for name, generate in ISLANDS.items() for seed in (0, 1)}
+
+
+def basic_map(name):
+    return convert_nhmap_to_basicmap(NH_Terrain_Map.from_buffer(ISLAND_BUFFERS[name]))
+
+
+def test_rectify_stack_matches_single_map_lookup():
+    basic_maps = [basic_map(name) for name in ISLAND_BUFFERS]
+    expected = [convert_basicmap_to_rectified_nhmap(island).dump_all() for island in basic_maps]
+    assert convert_basicmaps_to_rectified_nhmaps(basic_maps, encode=True) == expected
+    assert [nh_map.dump_all() for nh_map in convert_basicmaps_to_rectified_nhmaps(basic_maps)] == expected
+
+
+def test_rectify_image_matches_single_map_lookup(tmp_path):
+    pytest.importorskip('PIL')
+    island = basic_map('rivers0')
+    path = str(tmp_path / 'map.png')
+    island.save_img(path)
+    assert rectify_image(path) == convert_basicmap_to_rectified_nhmap(island).dump_all()
+
+
+def test_wrong_image_size(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    path = str(tmp_path / 'small.png')
+    Image.new('RGB', (100, 96)).save(path)
+    with pytest.raises(ValueError, match='expected a 112x96 image, got 100x96'):
+        rectify_image(path)
+    with pytest.raises(ValueError):
+        basic_map('flat0').from_rgb(np.zeros((96, 112), dtype=np.uint8))
+
+
+def test_rectify_many_matches_rectify_bytes():
+    buffers = list(ISLAND_BUFFERS.values())
+    assert rectify_many(buffers) == [rectify_bytes(data) for data in buffers]
+
+
+@pytest.mark.parametrize('name', ISLAND_BUFFERS)
+def test_rectify_many_single_island(name):
+    data = ISLAND_BUFFERS[name]
+    assert rectify_many([data]) == [rectify_bytes(data)]
+
+
+@pytest.mark.parametrize('name', ISLAND_BUFFERS)
+def test_match_patterns_non_contiguous(name):
+    # decode_map fields are transposed views of the column-major dump
+    records = decode_map(ISLAND_BUFFERS[name])
+    ground, elevation = GROUND_LUT[records['terrain_type']], records['elevation']
+    entries, levels = match_patterns(ground, elevation)
+    expected_entries, expected_levels = match_patterns(np.ascontiguousarray(ground), np.ascontiguousarray(elevation))
+    np.testing.assert_array_equal(entries, expected_entries)
+    np.testing.assert_array_equal(levels, expected_levels)
@@ -0,0 +1,24 @@
+import pytest
+
+from benchmarks.synthetic import ISLANDS
+from src.enums.tile_types import TerrainType, TERRAIN_CODES
+from src.nh_data.terrain import NH_Terrain_Map
+from src.nh_data.validator import validate_rectified
+from src.pipeline.rectify import rectify_map
+
+
+@pytest.mark.parametrize('name', ISLANDS)
+def test_rectified_islands_are_consistent(name):
+    data = ISLANDS[name](0)
+    assert validate_rectified(rectify_map(data), NH_Terrain_Map.from_buffer(data)) == []
+
+
+def test_wrong_tile_is_reported():
+    data = ISLANDS['cliffs'](0)
+    rectified = rectify_map(data)
+    y, x = 40, 50
+    rectified.terrain_code[y, x] = TERRAIN_CODES.code(TerrainType.Fall400)
+
+    errors = validate_rectified(rectified, NH_Terrain_Map.from_buffer(data))
+    assert [(error.y, error.x, error.acre) for error in errors] == [(y, x, 'C3')]
+    assert errors[0].actual[0] == TerrainType.Fall400